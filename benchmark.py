@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+
+# This file is part of sedlog-ffq, Copyright 2009, 2017, 2019 Pontus Lurcock
+# (pont at talvi dot net) and released under the MIT license:
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Benchmarks for the sediment log renderer, run on synthetic sections.
+
+Usage: benchmark.py [--save] [N_BEDS ...]
+
+Each stage is timed, then run again to measure its peak Python memory use,
+since tracing allocations slows Python code down. With --save,
+the results become the baseline for later runs; otherwise stages that are
+markedly slower than the baseline are reported as regressions.
+"""
+
+import argparse
+import csv
+import glob
+import importlib.util
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import cairocffi as cairo
+
+import symb
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+baseline_filename = os.path.join(base_dir, 'cache', 'benchmark-baseline.json')
+
+
+def load_make_log():
+    # make-log.py isn't importable under its own name
+    spec = importlib.util.spec_from_file_location(
+        'make_log', os.path.join(base_dir, 'make-log.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+make_log = load_make_log()
+
+sed_headers = ['btm', 'U', 'th', 'cont', 'lith', 'grain', 'btrb', 'burrows',
+               'fossils', 'other sed struct', 'clast', 'colour', 'smp',
+               'drill', 'protrusn', 'glc%', 'acid', 'ms', 'label-offs',
+               'mineral', 'notes']
+
+
+def synthesize(directory, n_beds, seed=1):
+    """Write a synthetic section of n_beds beds to a directory.
+
+    The section is written as sed-data.csv, ms.txt and site-incdec.csv in
+    the formats of the files in input-data, and spans n_beds * 6 cm.
+    Returns the bottom and top heights of the section.
+    """
+    rng = random.Random(seed)
+    thick = 6
+    bot = 0
+    top = n_beds * thick
+    with open(os.path.join(directory, 'sed-data.csv'), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(sed_headers)
+        for i in range(n_beds):
+            row = dict.fromkeys(sed_headers, '')
+            row['U'] = top - (i + 1) * thick
+            row['th'] = thick
+            if rng.random() < 0.02:
+                row['lith'] = 'ne'
+            else:
+                row['lith'] = rng.choice(('sst', 'sist'))
+                row['grain'] = rng.choice(('silt', 'vfs'))
+            row['glc%'] = rng.choice(('', '0', '5', '20', '50', '90'))
+            row['acid'] = rng.choice(('', '0', '1', '2', '3', '4'))
+            if rng.random() < 0.1:
+                row['burrows'] = rng.choice(('glc filled', 'pyt;hz'))
+            if rng.random() < 0.05:
+                row['fossils'] = 'wf'
+            if rng.random() < 0.05:
+                row['cont'] = 'irr'
+            if rng.random() < 0.1:
+                row['colour'] = '5y 4/1'
+            if rng.random() < 0.02:
+                row['notes'] = 'orange-fringed burrows with|white sand flecks'
+            if rng.random() < 0.05:
+                row['drill'] = 'S%d' % i
+            w.writerow([row[h] for h in sed_headers])
+    with open(os.path.join(directory, 'ms.txt'), 'w') as f:
+        for h in range(bot, top, 4):
+            f.write('%d \t%g\n' % (h, rng.uniform(0.00005, 0.0008)))
+    with open(os.path.join(directory, 'site-incdec.csv'), 'w',
+              newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['site', 'height', 'N', 'T1', 'T2', 'dec', 'inc', 'a95',
+                    'k'])
+        for i, h in enumerate(range(top - 50, bot, -100)):
+            w.writerow(['S%d' % i, h, 4, '25', '150–250',
+                        '%.1f' % rng.uniform(0, 360),
+                        '%.1f' % rng.uniform(40, 90), '1.0', '50.0'])
+    return bot, top
+
+
+def measure(function, setup=None):
+    """Call function and return its result, wall time and peak memory.
+
+    The time is taken from a first call and the peak memory from a second,
+    traced call; setup(), if given, is called before each.
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def clear_input_cache(filename):
+    """Remove make_log's cached columns for an input file."""
+    pattern = os.path.join(make_log.input_cache_dir,
+                           glob.escape(os.path.basename(filename)) + '-*')
+    for cache in glob.glob(pattern):
+        shutil.rmtree(cache, True)
+
+
+def recording_context():
+    return cairo.Context(
+        cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None))
+
+
+def draw_symbols(n):
+    ctx = recording_context()
+    for i in range(n):
+        symb.calc(ctx, 50, i, 4)
+        symb.burrow(ctx, 60, i, 4, i % 2 == 0)
+        symb.wood(ctx, 70, i, 4)
+        symb.glc(ctx, 16, i, 90, 60)
+        symb.irregular_contact(ctx, 16, i, 90)
+
+
+def run_benchmarks(n_beds):
+    """Run every stage on a synthetic section; return {stage: results}."""
+    results = {}
+
+    def stage(name, function, setup=None):
+        result, seconds, peak = measure(function, setup)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot, top = synthesize(directory, n_beds)
+        # keep the input cache for the synthetic files out of cache/
+        make_log.input_cache_dir = os.path.join(directory, 'inputs')
+        sed_file = os.path.join(directory, 'sed-data.csv')
+        ms_file = os.path.join(directory, 'ms.txt')
+        stage('read_csv', lambda: make_log.read_csv(sed_file),
+              lambda: clear_input_cache(sed_file))
+        section = stage('read_csv_cached',
+                        lambda: make_log.read_csv(sed_file))
+        ms_values = stage('read_magsus', lambda: make_log.read_magsus(ms_file),
+                          lambda: clear_input_cache(ms_file))
+        sites = make_log.read_sites(os.path.join(directory,
+                                                 'site-incdec.csv'))
+    scale = 0.24
+    page = make_log.Page.for_log(bot, top, scale)
+    job = make_log.PageJob(bot, top, scale, (),
+                           settings={'decs_incs_list': sites})
+    make_log.init_worker(section, ms_values)
+    make_log.start_job(job)
+    stage('draw_beds', lambda: make_log.draw_beds(
+        recording_context(), section, page, bot, top))
+    stage('draw_magsus', lambda: make_log.draw_magsus(
+        recording_context(), page, bot, top, ms_values))
+    stage('draw_decsincs_graph', lambda: make_log.draw_decsincs_graph(
+        recording_context(), page, bot, top))
+    stage('symb', lambda: draw_symbols(min(n_beds, 10000)))
+
+    def layout():
+        make_log.start_job(job)
+        make_log.draw_page_content(recording_context(), bot, top, section,
+                                   ms_values, scale, ())
+    stage('layout', layout)
+
+    def pdf_page():
+        make_log.start_job(job)
+        surface = cairo.PDFSurface(io.BytesIO(), make_log.page_width,
+                                   make_log.page_height(bot, top, scale))
+        make_log.draw_page_content(cairo.Context(surface), bot, top,
+                                   section, ms_values, scale, ())
+        surface.finish()
+    stage('draw_page', pdf_page)
+    return results
+
+
+def read_baseline():
+    try:
+        with open(baseline_filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the renderer.')
+    parser.add_argument('sizes', metavar='N_BEDS', type=int, nargs='*',
+                        default=[1000, 10000],
+                        help='numbers of beds in the synthetic sections')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown factor reported as a regression')
+    args = parser.parse_args()
+    baseline = read_baseline()
+    regressions = 0
+    for n_beds in args.sizes:
+        results = run_benchmarks(n_beds)
+        old_results = baseline.get(str(n_beds), {})
+        print('%d beds' % n_beds)
+        for name, result in results.items():
+            line = '  %-20s %9.4f s %10.1f kB' % \
+                (name, result['seconds'], result['peak_bytes'] / 1024)
+            if name in old_results:
+                ratio = result['seconds'] / \
+                    max(old_results[name]['seconds'], 1e-9)
+                line += '  %5.2fx baseline' % ratio
+                if ratio > args.tolerance:
+                    line += '  REGRESSION'
+                    regressions += 1
+            print(line)
+        baseline[str(n_beds)] = results
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_filename), exist_ok=True)
+        with open(baseline_filename, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    exit(main())
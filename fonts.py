@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+# This file is part of sedlog-ffq, Copyright 2009, 2017, 2019 Pontus Lurcock
+# (pont at talvi dot net) and released under the MIT license:
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Font faces shared by the text and symbols of the log.
+
+Fonts shipped with sedlog-ffq are loaded from their files through
+FreeType once per process, so drawing doesn't depend on the fonts being
+installed or on fontconfig lookups. Bold is synthesized from the regular
+face. Other fonts, or all fonts if FreeType or cairo's FreeType support
+can't be loaded, fall back to cairo's toy font faces.
+"""
+
+import logging
+import os
+
+import cairocffi as cairo
+
+logger = logging.getLogger('sedlog')
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# family name -> font file, for the fonts shipped with the program
+bundled = {'NimbusSanLCon': os.path.join(base_dir, 'NimbusSanL-ReguCond.ttf')}
+
+ft_cdef = '''
+    typedef int FT_Error;
+    typedef void *FT_Library;
+    typedef void *FT_Face;
+    typedef void cairo_font_face_t;
+    FT_Error FT_Init_FreeType(FT_Library *alibrary);
+    FT_Error FT_New_Face(FT_Library library, const char *filepathname,
+                         long face_index, FT_Face *aface);
+    cairo_font_face_t *cairo_ft_font_face_create_for_ft_face(
+        FT_Face face, int load_flags);
+    void cairo_ft_font_face_set_synthesize(cairo_font_face_t *font_face,
+                                           unsigned int synth_flags);
+    int cairo_font_face_status(cairo_font_face_t *font_face);
+    void cairo_font_face_destroy(cairo_font_face_t *font_face);
+'''
+
+FT_SYNTHESIZE_BOLD = 1
+
+faces = {}  # (family, bold) -> font face
+face_keys = {}  # address of a FreeType font face -> its key
+freetype = None  # (ffi, FreeType, cairo, FT_Library) once loaded
+
+
+def load_freetype():
+    """Load FreeType and cairo's FreeType functions, once per process.
+
+    Returns None if they are not available.
+    """
+    global freetype
+    if freetype is None:
+        try:
+            freetype = open_freetype()
+        except (OSError, AttributeError, ImportError) as e:
+            logger.warning('Cannot load fonts through FreeType, so using '
+                           'toy font faces: %s', e)
+            freetype = False
+    return freetype or None
+
+
+def open_freetype():
+    import cffi
+    ffi = cffi.FFI()
+    ffi.cdef(ft_cdef)
+    ft = cairo.dlopen(
+        ffi, ('freetype', 'libfreetype-6'),
+        ('libfreetype.so.6', 'libfreetype.6.dylib', 'libfreetype-6.dll'))
+    cairo_ft = cairo.dlopen(
+        ffi, ('cairo-2', 'cairo', 'libcairo-2'),
+        ('libcairo.so.2', 'libcairo.2.dylib', 'libcairo-2.dll'))
+    library = ffi.new('FT_Library *')
+    if ft.FT_Init_FreeType(library) != 0:
+        raise OSError('cannot initialize FreeType')
+    return ffi, ft, cairo_ft, library[0]
+
+
+def address(face):
+    return int(cairo.ffi.cast('uintptr_t', face._pointer))
+
+
+def load_face(filename, bold):
+    """Load a cairo font face from a font file through FreeType, or return
+    None if FreeType is not available."""
+    if load_freetype() is None:
+        return None
+    ffi, ft, cairo_ft, library = freetype
+    ft_face = ffi.new('FT_Face *')
+    if ft.FT_New_Face(library, filename.encode(), 0, ft_face) != 0:
+        raise OSError('cannot load font file ' + filename)
+    # The FreeType face is never freed, as faces last for the process.
+    pointer = cairo_ft.cairo_ft_font_face_create_for_ft_face(ft_face[0], 0)
+    if bold:
+        cairo_ft.cairo_ft_font_face_set_synthesize(pointer,
+                                                   FT_SYNTHESIZE_BOLD)
+    status = cairo_ft.cairo_font_face_status(pointer)
+    if status != 0:
+        cairo_ft.cairo_font_face_destroy(pointer)
+        raise OSError('cannot create a font face for %s (cairo status %d)'
+                      % (filename, status))
+    return cairo.FontFace._from_pointer(
+        cairo.ffi.cast('cairo_font_face_t *',
+                       int(ffi.cast('uintptr_t', pointer))),
+        incref=False)
+
+
+def face(family, bold=False):
+    """Return the shared font face for a family, loading it on first use."""
+    key = (family, bold)
+    if key not in faces:
+        if family in bundled:
+            try:
+                loaded = load_face(bundled[family], bold)
+            except (OSError, AttributeError) as e:
+                logger.warning('Using a toy font face for %s: %s',
+                               family, e)
+                loaded = None
+            if loaded is not None:
+                faces[key] = loaded
+                face_keys[address(loaded)] = key
+        if key not in faces:
+            faces[key] = cairo.ToyFontFace(
+                family, cairo.FONT_SLANT_NORMAL,
+                cairo.FONT_WEIGHT_BOLD if bold else cairo.FONT_WEIGHT_NORMAL)
+    return faces[key]
+
+
+def face_key(font_face):
+    """Return a hashable key for a font face, or None if it is neither a
+    toy face nor one loaded by face()."""
+    if isinstance(font_face, cairo.ToyFontFace):
+        return (font_face.get_family(), font_face.get_slant(),
+                font_face.get_weight())
+    return face_keys.get(address(font_face))
@@ -23,18 +23,36 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import argparse
 import csv
-from math import pi, radians
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from math import ceil, isfinite, pi, radians
+from multiprocessing import Pool
+from urllib.parse import parse_qsl, urlsplit
 
 import cairocffi as cairo
+import numpy as np
 
+import fonts
 import symb
 
 
 def mm_to_pt(mm):
     return (mm / 25.4) * 72
 
-# Scale & Page only used for currents
+# Mappings from section heights to page positions, used by every column
 
 
 class Scale:
@@ -54,8 +72,16 @@ class Scale:
     def pos(self, src):
         return self.dst_min + self.scale_factor * (src-self.src_min)
 
+    def src(self, dst):
+        return self.src_min + (dst-self.dst_min) / self.scale_factor
+
 
 class Page:
+    """Maps section heights to vertical positions on a page.
+
+    pos() and length() take single heights or whole arrays of them.
+    """
+
     def __init__(self, s_top, s_bot, p_top, p_bot):
         self.s_top = s_top
         self.s_bot = s_bot
@@ -63,6 +89,24 @@ class Page:
         self.p_bot = p_bot
         self.scale = Scale(s_top, s_bot, p_top, p_bot)
 
+    @classmethod
+    def for_log(cls, bot_clip, top_clip, scale):
+        """The mapping for a log of the given range and scale (in points
+        per cm), with the top of the range top_margin below the top of
+        the page."""
+        return cls(top_clip, bot_clip, top_margin,
+                   top_margin + (top_clip - bot_clip) * scale)
+
+    def pos(self, heights):
+        return self.scale.pos(heights)
+
+    def height(self, positions):
+        return self.scale.src(positions)
+
+    def length(self, thicknesses):
+        # heights run upward and page positions downward
+        return -self.scale.length(thicknesses)
+
 
 class LogSettings:
 
@@ -70,17 +114,20 @@ class LogSettings:
         self.fmn_name_offset = -8  # vertical offset of formation name
         self.stagger_pmag = False  # whether to stagger pmag sites
         self.pmag_stagger = 12  # distance by which to stagger pmag sites
+        self.first_pmag_stagger = 0  # stagger step of the first pmag site
         self.glc_voffset = 20  # vertical offset for g symbols
         self.glc_int = 20  # don't draw g closer than this unless changing
         self.glc_int_2 = 1  # don't draw g closer than this even if changing
         self.symb_int = 12  # don't draw other symbols closer than this
         self.special_pmag_offsets = {'D1': 0, 'D2': 1}
         self.all_drill_sites = True  # if False, only draw valid sites
-        self.decs_incs_list = None  # put table here to draw decs & incs
+        self.decs_incs_list = None  # put Sites here to draw decs & incs
         self.ages = None
         self.currents = False
         self.magsus_scale = 50000  # horizontal scale of mag. sus. graph
+        self.magsus_resolution = 1  # min. vertical spacing of mag. sus. points
         self.lith_width = 45  # horizontal scale of lithology column
+        self.min_bed_height = 0  # merge similar beds thinner than this
         self.pdf_output = True  # True for PDF, False for SVG
         self.font_name = 'NimbusSanLCon'
 
@@ -92,18 +139,17 @@ class LogState:
         self.last_burrow = -1e6
         self.last_calc = -1e6
         self.last_wood = -1e6
+        self.last_glc_height = None
 
 
 log_settings = LogSettings()
 log_state = LogState()
-liths = {'sst': symb.sand_pattern(), 'sist': symb.silt_pattern()}
-burrow_pattern = symb.burrow_pattern()
+liths = {'sst': 'sand', 'sist': 'silt'}  # lithology -> pattern name
 grain_sizes = ['clay', 'silt', 'vfs']  # , 'fs', 'ms']
 grain_sizes_print = ['clay', 'silt', 'v. f. sand']
 grain_index = {}
 for grain_size_index in range(0, len(grain_sizes)):
     grain_index[grain_sizes[grain_size_index]] = grain_size_index
-last_glc_height = None
 
 hz_pos_mm = {
     'scale':    7,
@@ -119,9 +165,18 @@ hz_pos_mm = {
     'dec_g':   95,
     'inc_g':  124
 }
-hz_pos = {}
-for v in hz_pos_mm.keys():
-    hz_pos[v] = mm_to_pt(hz_pos_mm[v])
+
+
+def make_hz_pos(overrides=None):
+    positions = {}
+    for v in hz_pos_mm.keys():
+        positions[v] = mm_to_pt(hz_pos_mm[v])
+    if overrides is not None:
+        positions.update(overrides)
+    return positions
+
+
+hz_pos = make_hz_pos()
 
 fmns_paged = (
  ('Fairfield Greensand Member', 500, 740),
@@ -162,8 +217,64 @@ def ffloat(s):
     return float(s)
 
 
+def font_key(ctx):
+    """Return a hashable key for the current font of a context, or None if
+    it is not a toy font or one of the shared faces in fonts."""
+    face = fonts.face_key(ctx.get_font_face())
+    if face is None:
+        return None
+    return face + (ctx.get_font_matrix().as_tuple(),)
+
+
+def metrics_key(ctx):
+    """Return font_key(ctx) extended with everything else that can change
+    the metrics of text in the current font, or None."""
+    font = font_key(ctx)
+    if font is None:
+        return None
+    # glyph advances may be hinted for the device scale and font options
+    options = ctx.get_font_options()
+    return font + (ctx.get_matrix().as_tuple()[:4],
+                   (options.get_antialias(), options.get_subpixel_order(),
+                    options.get_hint_style(), options.get_hint_metrics()))
+
+
+class TextMetrics:
+    """A least-recently-used cache of text extents.
+
+    Extents are keyed by metrics_key and text; hits and misses
+    count the lookups that were and weren't answered from the cache.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.extents = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def text_extents(self, ctx, text):
+        font = metrics_key(ctx)
+        if font is None:
+            self.misses += 1
+            return ctx.text_extents(text)
+        key = (font, text)
+        if key in self.extents:
+            self.hits += 1
+            self.extents.move_to_end(key)
+            return self.extents[key]
+        self.misses += 1
+        extents = ctx.text_extents(text)
+        self.extents[key] = extents
+        if len(self.extents) > self.max_size:
+            self.extents.popitem(last=False)
+        return extents
+
+
+text_metrics = TextMetrics()
+
+
 def align_text(ctx, x, y, text, horiz='l', vert='b'):
-    extents = ctx.text_extents(text)
+    extents = text_metrics.text_extents(ctx, text)
     w = extents[2]
     h = extents[3]
     if horiz == 'l':
@@ -182,164 +293,665 @@ def align_text(ctx, x, y, text, horiz='l', vert='b'):
     ctx.show_text(text)
 
 
-def write_lines(ctx, x_pos, y_pos, spacing, lines):
+# (metrics key, text) -> glyphs of the text drawn at the origin
+glyph_cache = {}
+glyph_cache_size = 4096
+
+
+class GlyphRun:
+    """Text in one font, collected as glyphs to be drawn in one go.
+
+    Each distinct string is converted to glyphs once and the conversion
+    cached; show() then draws everything added with a single show_glyphs
+    call. The font is the context's current font when the run is created,
+    or face at the current font size if given.
+    """
+
+    def __init__(self, ctx, face=None):
+        ctx.save()
+        if face is not None:
+            ctx.set_font_face(face)
+        self.face = ctx.get_font_face()
+        self.matrix = ctx.get_font_matrix()
+        self.scaled_font = ctx.get_scaled_font()
+        self.font = metrics_key(ctx)
+        ctx.restore()
+        self.glyphs = []
+
+    def add(self, x, y, text):
+        key = (self.font, text)
+        glyphs = glyph_cache.get(key) if self.font is not None else None
+        if glyphs is None:
+            glyphs = self.scaled_font.text_to_glyphs(0, 0, text, False)
+            if self.font is not None:
+                if len(glyph_cache) >= glyph_cache_size:
+                    glyph_cache.clear()
+                glyph_cache[key] = glyphs
+        for (index, g_x, g_y) in glyphs:
+            self.glyphs.append((index, x + g_x, y + g_y))
+
+    def show(self, ctx):
+        if not self.glyphs:
+            return
+        ctx.save()
+        ctx.set_font_face(self.face)
+        ctx.set_font_matrix(self.matrix)
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.show_glyphs(self.glyphs)
+        ctx.restore()
+        self.glyphs = []
+
+
+def write_lines(ctx, x_pos, y_pos, spacing, lines, run=None):
     for i in range(len(lines)):
-        ctx.move_to(x_pos, y_pos + i * spacing)
-        ctx.show_text(lines[i])
-
-
-class Datum:
-
-    def __init__(self, prm):
-        self.bot = float(prm['U'])
-        self.thick = float(prm['th'])
-        self.gs = (prm['grain'])
-        self.lith = (prm['lith'])
-        self.glc = ffloat(prm['glc%'])
-        self.drill = prm['drill']
-        self.burrow = prm['burrows']
-        self.acid = prm['acid']
-        self.fossil = prm['fossils']
-        self.colour = prm['colour']
-        self.magsus = prm['ms']
-        self.contact = prm['cont']
-        self.notes = prm['notes']
-        self.label_offs = ffloat(prm['label-offs'])
+        if run is None:
+            ctx.move_to(x_pos, y_pos + i * spacing)
+            ctx.show_text(lines[i])
+        else:
+            run.add(x_pos, y_pos + i * spacing, lines[i])
+
+
+lith_names = ['', 'ne', 'sst', 'sist']
+lith_codes = {}
+for lith_index in range(0, len(lith_names)):
+    lith_codes[lith_names[lith_index]] = lith_index
+LITH_NONE = lith_codes['']
+LITH_NE = lith_codes['ne']
+
+# Section attribute name -> CSV column name
+float_columns = {'bot': 'U', 'thick': 'th', 'glc': 'glc%', 'acid': 'acid',
+                 'magsus': 'ms', 'label_offs': 'label-offs'}
+text_columns = {'drill': 'drill', 'burrow': 'burrows', 'fossil': 'fossils',
+                'colour': 'colour', 'contact': 'cont', 'notes': 'notes'}
+code_columns = {'lith': ('lith', lith_codes), 'grain': ('grain', grain_index)}
+
+
+class DepthIndex:
+    """A sorted index over an array of depths.
+
+    window() returns the positions of all depths within a range in
+    O(log n + k) time, in their original (file) order.
+    """
+
+    def __init__(self, depths):
+        self.order = np.argsort(depths, kind='stable')
+        self.depths = np.asarray(depths)[self.order]
+
+    def window(self, lo, hi):
+        start = np.searchsorted(self.depths, lo, 'left')
+        end = np.searchsorted(self.depths, hi, 'right')
+        return np.sort(self.order[start:end])
+
+
+def parse_floats(values, missing):
+    """Parse an array of strings as floats, with missing for empty ones."""
+    values = np.asarray(values, dtype=str)
+    result = np.full(len(values), missing)
+    given = values != ''
+    result[given] = values[given].astype(float)
+    return result
+
+
+def parse_float_column(name, values):
+    if name in ('bot', 'thick'):
+        return np.asarray(values, dtype=str).astype(float)
+    # keep 'no measurement' distinct from zero for magsus
+    return parse_floats(values, np.nan if name == 'magsus' else 0.)
+
+
+def parse_code_column(header, values, codes):
+    """Convert names to codes; empty names not in codes become -1."""
+    names, inverse = np.unique(np.asarray(values, dtype=str),
+                               return_inverse=True)
+    for name in names:
+        if name != '' and name not in codes:
+            raise ValueError('unknown %s %r' % (header, str(name)))
+    name_codes = np.array([codes.get(name, -1) for name in names],
+                          dtype=np.int8)
+    return name_codes[inverse.ravel()]
+
+
+def read_csv_columns(filename):
+    """Read a CSV file into a dict of string arrays, keyed by header."""
+    f = open(filename, 'rt')
+    r = csv.reader(f)
+    headers = next(r)
+    columns = rows_to_columns(headers, list(r))
+    f.close()
+    return columns
+
+
+def rows_to_columns(headers, rows):
+    n = len(headers)
+    rows = [row + [''] * (n - len(row)) for row in rows if row]
+    values = zip(*rows) if rows else [()] * n
+    return dict(zip(headers, [np.array(column, dtype=str)
+                              for column in values]))
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(partial(f.read, 1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+input_cache_dir = os.path.join(symb.cache_dir, 'inputs')
+input_cache_version = 1
+parser_version = None
+
+
+def input_parser_version():
+    """Return the version of the input parsers, and of the code tables
+    they use, as the version of the code; computed once per process."""
+    global parser_version
+    if parser_version is None:
+        parser_version = '%d:%s' % (input_cache_version, code_version())
+    return parser_version
+
+
+def write_cache_meta(meta_path, meta):
+    tmp_path = '%s.%d.tmp' % (meta_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def cached_columns(filename, parse):
+    """Return the columns that parse(filename) produces, through a cache.
+
+    The columns are stored as .npy files, which are memory-mapped on
+    later calls. The cache is valid while the parsing code is unchanged
+    and the file's size and modification time are unchanged; if only the
+    time has changed, the file's hash is checked, and the new time
+    recorded if it matches, before the cache is rebuilt.
+    """
+    path = os.path.abspath(filename)
+    key = hashlib.sha1(('%s:%d' % (path, input_cache_version)).encode())
+    cache = os.path.join(input_cache_dir, '%s-%s' % (
+        os.path.basename(filename), key.hexdigest()[:16]))
+    meta_path = os.path.join(cache, 'meta.json')
+    stat = os.stat(filename)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        valid = meta['version'] == input_parser_version() and \
+            meta['size'] == stat.st_size and \
+            (meta['mtime'] == stat.st_mtime_ns or
+             meta['sha1'] == file_digest(filename))
+        if valid and meta['mtime'] != stat.st_mtime_ns:
+            meta['mtime'] = stat.st_mtime_ns
+            try:
+                write_cache_meta(meta_path, meta)
+            except OSError:
+                pass
+        if valid:
+            return dict((name, np.load(os.path.join(cache, name + '.npy'),
+                                       mmap_mode='r'))
+                        for name in meta['columns'])
+    except (OSError, ValueError, KeyError):
+        pass
+    columns = parse(filename)
+    try:
+        os.makedirs(cache, exist_ok=True)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name, column in columns.items():
+            tmp_path = os.path.join(cache, '%s.%d.tmp.npy' %
+                                    (name, os.getpid()))
+            np.save(tmp_path, column)
+            os.replace(tmp_path, os.path.join(cache, name + '.npy'))
+        meta = {'version': input_parser_version(), 'size': stat.st_size,
+                'mtime': stat.st_mtime_ns, 'sha1': file_digest(filename),
+                'columns': list(columns)}
+        write_cache_meta(meta_path, meta)
+    except OSError:
+        pass
+    return columns
+
+
+class Section:
+    """Bed data for a section, stored as one array per attribute.
+
+    Element i of every array describes row i of the input CSV; rows keep
+    the file order, so bed i - 1 is the bed above bed i. A section read in
+    chunks starts with the last row of the previous chunk, which is only
+    there as the bed above the first new row; start is the index of the
+    first row that belongs to the chunk itself. Lithology and
+    grain size are stored as indices into lith_names and grain_sizes
+    (-1 for an empty or unknown grain size). An empty magsus entry is NaN.
+    """
+
+    def __init__(self, columns, start=0):
+        self.start = start
+        for name in float_columns:
+            setattr(self, name, columns[name])
+        for name in text_columns:
+            setattr(self, name, columns[name])
+        for name in code_columns:
+            setattr(self, name, columns[name])
+        self._index = None
+        self._widths = {}
+
+    @staticmethod
+    def parse_columns(by_header):
+        """Convert CSV columns of strings to Section columns."""
+        columns = {}
+        for name, header in float_columns.items():
+            columns[name] = parse_float_column(name, by_header[header])
+        for name, header in text_columns.items():
+            columns[name] = by_header[header]
+        for name, (header, codes) in code_columns.items():
+            columns[name] = parse_code_column(header, by_header[header],
+                                             codes)
+        return columns
+
+    @classmethod
+    def from_rows(cls, headers, rows, start=0):
+        return cls(cls.parse_columns(rows_to_columns(headers, rows)), start)
+
+    def __len__(self):
+        return len(self.bot)
 
     def top(self):
         return self.bot + self.thick
 
-    def draw_lith(self, ctx, bot, top, xoffs, width_b, width_t):
-        ctx.move_to(xoffs, bot)
-        ctx.set_line_width(.5)
-        ctx.rel_line_to(width_b, 0)
-        ctx.line_to(xoffs + width_t, top)
-        ctx.line_to(xoffs, top)
-        ctx.close_path()
-        ctx.set_source(liths[self.lith])
-        ctx.fill_preserve()
-        if self.lith == 'sist':
-            ctx.set_source(burrow_pattern)
-        ctx.fill()
-        ctx.set_line_width(.5)
-        ctx.set_source_rgb(0, 0, 0)
-        ctx.move_to(xoffs, bot)
-        ctx.line_to(xoffs, top)
-        ctx.stroke()
-        ctx.move_to(xoffs + width_b, bot)
-        ctx.line_to(xoffs + width_t, top)
-        ctx.stroke()
+    def window(self, bot_clip, top_clip):
+        """Return the positions of all beds lying within a depth range."""
+        if self._index is None:
+            self._index = DepthIndex(self.bot)
+        i = self._index.window(bot_clip, top_clip)
+        return i[(self.bot[i] + self.thick[i] <= top_clip) & (i >= self.start)]
+
+    def widths(self, lith_width):
+        """Return the bottom and top widths of every bed's lithology polygon.
+
+        The top of a bed meets the bottom of the bed above it, unless the
+        bed above has no lithology or is not exposed.
+        """
+        if lith_width not in self._widths:
+            width_b = (1 + self.grain.astype(int)) * lith_width
+            width_t = width_b.copy()
+            above_drawn = (self.lith[:-1] != LITH_NONE) & \
+                          (self.lith[:-1] != LITH_NE)
+            width_t[1:] = np.where(above_drawn, width_b[:-1], width_b[1:])
+            self._widths[lith_width] = width_b, width_t
+        return self._widths[lith_width]
+
+
+class LithPaths:
+    """Lithology polygons for a column, collected to be drawn together.
+
+    draw() fills all the polygons of each lithology as one path, with a
+    single source change per pattern, then strokes the sides of every
+    polygon as one path. Anything else drawn in the column must be drawn
+    after draw() is called, to keep it on top of the polygons below it.
+    """
 
-    def draw_noexp(self, ctx, top, height, xoffs, width):
+    def __init__(self):
+        self.polygons = OrderedDict()  # lithology -> [(bot, top, ...)]
+
+    def add(self, bot, top, xoffs, width_b, width_t, lith):
+        self.polygons.setdefault(lith, []).append(
+            (bot, top, xoffs, width_b, width_t))
+
+    def draw(self, ctx):
+        if not self.polygons:
+            return
         ctx.set_line_width(.5)
-        ctx.rectangle(xoffs, top, width, height)
-        ctx.move_to(xoffs, top)
-        ctx.rel_line_to(width, height)
-        ctx.rel_move_to(0, -height)
-        ctx.rel_line_to(-width, height)
+        for lith, polygons in self.polygons.items():
+            for (bot, top, xoffs, width_b, width_t) in polygons:
+                ctx.move_to(xoffs, bot)
+                ctx.rel_line_to(width_b, 0)
+                ctx.line_to(xoffs + width_t, top)
+                ctx.line_to(xoffs, top)
+                ctx.close_path()
+            ctx.set_source(symb.get_pattern(liths[lith]))
+            if lith == 'sist':
+                ctx.fill_preserve()
+                ctx.set_source(symb.get_pattern('burrow'))
+            ctx.fill()
         ctx.set_source_rgb(0, 0, 0)
+        for polygons in self.polygons.values():
+            for (bot, top, xoffs, width_b, width_t) in polygons:
+                ctx.move_to(xoffs, bot)
+                ctx.line_to(xoffs, top)
+                ctx.move_to(xoffs + width_b, bot)
+                ctx.line_to(xoffs + width_t, top)
         ctx.stroke()
-        ctx.fill()
+        self.polygons.clear()
 
-    def draw(self, height, ctx, scale, next_datum, yoffs):
-        xoffs = hz_pos['lith']
-        top = (height - (self.bot + self.thick) + yoffs) * scale
-        bot = (height - self.bot + yoffs) * scale
-        width = 100
-        global log_state
-        if self.thick > 0:
-            if self.lith != 'ne':
-                width_b = (1 + grain_index[self.gs]) * log_settings.lith_width
-                if next_datum is not None and next_datum.lith != '' and \
-                        next_datum.lith != 'ne':
-                    width_t = (1 + grain_index[next_datum.gs]) * \
-                              log_settings.lith_width
-                else:
-                    width_t = width_b
-                self.draw_lith(ctx, bot, top, xoffs, width_b, width_t)
-                width = min(width_t, width_b)
-            else:
-                self.draw_noexp(ctx, top, self.thick*scale, xoffs, width)
-        if top < log_state.last_calc:
-            log_state.last_calc = -1e6
-        if self.acid != '' and float(self.acid) > 2 and \
-                top-log_state.last_calc > log_settings.symb_int:
-            symb.calc(ctx, xoffs + 50, top + 4, 4)
-            if float(self.acid) > 3:
-                symb.calc(ctx, xoffs + 20, top + 6, 4)
-            log_state.last_calc = top
-        if top < log_state.last_burrow:
-            log_state.last_burrow = -1e6
-        if self.burrow != '' and \
-                top - log_state.last_burrow > log_settings.symb_int:
-            symb.burrow(ctx, xoffs + 10, top + 6, 4,
-                        self.burrow.find('py') > -1)
-            log_state.last_burrow = top
-        if top < log_state.last_wood:
-            log_state.last_wood = -1e6
-        if self.fossil != '' and \
-                top - log_state.last_wood > log_settings.symb_int:
-            symb.wood(ctx, xoffs+30, top+6, 4)
-            log_state.last_wood = top
-        if self.colour != '' and hz_pos['colour'] is not None:
-            ctx.move_to(hz_pos['colour'], bot+3)
-            ctx.show_text(self.colour)
-        if self.contact != '':
-            symb.irregular_contact(ctx, xoffs, bot, width_b)
-        if self.notes != '' and hz_pos['notes'] is not None:
-            write_lines(ctx, hz_pos['notes'], bot + 3, 8,
-                        self.notes.split('|'))
-            # ctx.move_to(hz_pos['notes'], bot+3)
-            # ctx.show_text(self.notes)
-        if self.magsus != '':
-            ms = float(self.magsus) * log_settings.magsus_scale
-            ctx.rectangle(hz_pos['magsus'], top - 4, ms, 8)
-            ctx.set_source_rgb(.8, .8, .8)
-            ctx.fill_preserve()
-            ctx.set_source_rgb(0, 0, 0)
-            ctx.set_line_width(0.5)
-            ctx.stroke()
+
+def draw_noexp(ctx, top, height, xoffs, width):
+    ctx.set_line_width(.5)
+    ctx.rectangle(xoffs, top, width, height)
+    ctx.move_to(xoffs, top)
+    ctx.rel_line_to(width, height)
+    ctx.rel_move_to(0, -height)
+    ctx.rel_line_to(-width, height)
+    ctx.set_source_rgb(0, 0, 0)
+    ctx.stroke()
+    ctx.fill()
+
+
+def space_symbols(candidates, tops, last, spacing):
+    """Choose which candidate beds get a symbol, keeping symbols spaced.
+
+    A symbol is drawn for a candidate if its top is more than spacing
+    below the last symbol drawn; if any bed's top is above the last symbol
+    (i.e. the beds are out of order), the spacing starts afresh. Returns
+    a boolean array of the beds that get a symbol, and the new position of
+    the last symbol.
+    """
+    drawn = np.zeros(len(tops), dtype=bool)
+    if len(tops) == 0:
+        return drawn, last
+    ends = np.flatnonzero(candidates) + 1
+    bounds = np.concatenate(([0], ends))
+    bounds = bounds[bounds < len(tops)]
+    # highest top from the previous candidate to each candidate
+    highest = np.minimum.reduceat(tops, bounds)
+    for k in range(len(ends)):
+        j = ends[k] - 1
+        if highest[k] < last:
+            last = -1e6
+        if tops[j] - last > spacing:
+            drawn[j] = True
+            last = tops[j]
+    if len(bounds) > len(ends) and highest[-1] < last:
+        last = -1e6
+    return drawn, last
+
+
+def declutter(section, beds, tops, state):
+    """Decide which symbols and labels to draw for a page's beds.
+
+    This is done for all the beds in a page (or a chunk of a stream) before
+    any are drawn, so that drawing doesn't depend on order or on any
+    shared state, and any subset of the beds can be drawn on its own.
+    Returns a dict of arrays parallel to beds; state carries the spacing
+    state on to the next chunk.
+    """
+    spacing = log_settings.symb_int
+    marks = {}
+    marks['calc'], state.last_calc = space_symbols(
+        section.acid[beds] > 2, tops, state.last_calc, spacing)
+    marks['burrow'], state.last_burrow = space_symbols(
+        section.burrow[beds] != '', tops, state.last_burrow, spacing)
+    marks['wood'], state.last_wood = space_symbols(
+        section.fossil[beds] != '', tops, state.last_wood, spacing)
+
+    glc = np.zeros(len(beds), dtype=bool)
+    bots = section.bot[beds].tolist()
+    same_glc = np.zeros(len(beds), dtype=bool)
+    after_first = beds > 0
+    same_glc[after_first] = section.glc[beds[after_first] - 1] == \
+        section.glc[beds[after_first]]
+    last = state.last_glc_height
+    for j in range(len(beds)):
+        bot = bots[j]
         do_glc = True
-        global last_glc_height
-        if next_datum is not None and last_glc_height is not None:
+        if beds[j] > 0 and last is not None:
             # a boolean mare's nest :-(
-            if (self.bot > (last_glc_height - log_settings.glc_int) and
-                    next_datum.glc == self.glc):
+            if bot > last - log_settings.glc_int and same_glc[j]:
                 do_glc = False
-            if self.bot > (last_glc_height - log_settings.glc_int_2):
+            if bot > last - log_settings.glc_int_2:
                 do_glc = False
-            if self.bot > last_glc_height:
+            if bot > last:
                 do_glc = True
-        # print self.bot, self.glc, last_glc_height, do_glc
         if do_glc:
-            symb.glc(ctx, xoffs, top+log_settings.glc_voffset, width, self.glc)
-            if last_glc_height is None:
-                last_glc_height = self.bot
-            else:
-                last_glc_height = min(self.bot, last_glc_height)
-        if self.drill != '':
-            drill_xpos = hz_pos['drill']
-            if log_settings.stagger_pmag:
-                if self.drill in log_settings.special_pmag_offsets:
-                    log_state.pmag_stagger = \
-                        log_settings.special_pmag_offsets[self.drill]
-                drill_xpos += log_state.pmag_stagger * log_settings.pmag_stagger
-                log_state.pmag_stagger = (log_state.pmag_stagger + 1) % 3
-            if (log_settings.all_drill_sites or 
-                    self.drill.lower() in valid_sites):
-                ctx.move_to(drill_xpos, bot + 3 - self.label_offs)
-                ctx.set_source_rgb(0, 0, 0)
-                ctx.show_text(self.drill)
+            glc[j] = True
+            last = bot if last is None else min(bot, last)
+    state.last_glc_height = last
+    marks['glc'] = glc
+
+    stagger = np.zeros(len(beds), dtype=int)
+    if log_settings.stagger_pmag:
+        drills = section.drill[beds]
+        for j in np.flatnonzero(drills != ''):
+            if drills[j] in log_settings.special_pmag_offsets:
+                state.pmag_stagger = \
+                    log_settings.special_pmag_offsets[drills[j]]
+            stagger[j] = state.pmag_stagger
+            state.pmag_stagger = (state.pmag_stagger + 1) % 3
+    marks['stagger'] = stagger
+    return marks
+
+
+def generalize(section, beds, tops, bots, min_height):
+    """Merge runs of thin beds for drawing their lithology.
+
+    Adjacent beds which are both less than min_height points tall and
+    have the same lithology and grain size are drawn as one polygon.
+    Returns the page position of the bottom of each bed's polygon (NaN
+    for beds drawn as part of a bed above) and the index in beds of the
+    bed which draws each bed's polygon.
+    """
+    lith_bots = np.array(bots, dtype=float)
+    heads = np.arange(len(beds))
+    if not min_height or len(beds) < 2:
+        return lith_bots, heads
+    lith = section.lith[beds]
+    grain = section.grain[beds]
+    drawn = (lith != LITH_NONE) & (lith != LITH_NE) & \
+        (section.thick[beds] > 0) & (bots - tops < min_height)
+    joined = np.zeros(len(beds), dtype=bool)
+    joined[1:] = drawn[:-1] & drawn[1:] & (np.diff(beds) == 1) & \
+        (lith[:-1] == lith[1:]) & (grain[:-1] == grain[1:]) & \
+        np.isclose(bots[:-1], tops[1:])
+    lith_bots[joined] = np.nan
+    starts = np.flatnonzero(~joined)
+    ends = np.append(starts[1:], len(beds)) - 1
+    lith_bots[starts] = bots[ends]
+    heads = np.maximum.accumulate(np.where(joined, 0, heads))
+    return lith_bots, heads
+
+
+def add_bed_lith(ctx, paths, section, i, top, width_b, width_t, page, marks,
+                 j):
+    """Add a bed's lithology to paths, or draw it if it was not exposed."""
+    xoffs = hz_pos['lith']
+    lith = section.lith[i]
+    if section.thick[i] > 0:
+        if lith != LITH_NE:
+            if not np.isnan(marks['lith_bot'][j]):
+                paths.add(marks['lith_bot'][j], top, xoffs, width_b,
+                          width_t, lith_names[lith])
+        else:
+            paths.draw(ctx)
+            draw_noexp(ctx, top, page.length(section.thick[i]), xoffs, 100)
+
+
+def draw_bed(ctx, paths, section, i, top, bot, width_b, width_t, labels,
+             glc_run, marks, j):
+    """Draw a bed's symbols and labels."""
+    xoffs = hz_pos['lith']
+    width = 100
+    if section.thick[i] > 0 and section.lith[i] != LITH_NE:
+        width = min(width_t, width_b)
+    if marks['calc'][j] or marks['burrow'][j] or marks['wood'][j] or \
+            section.contact[i] != '':
+        # the symbols go over this bed's lithology and that of the beds
+        # before it, but under that of the beds after it
+        paths.draw(ctx)
+    if marks['calc'][j]:
+        symb.stamp(ctx, 'calc', xoffs + 50, top + 4, 4)
+        if section.acid[i] > 3:
+            symb.stamp(ctx, 'calc', xoffs + 20, top + 6, 4)
+    if marks['burrow'][j]:
+        symb.stamp(ctx, 'burrow', xoffs + 10, top + 6, 4,
+                   section.burrow[i].find('py') > -1)
+    if marks['wood'][j]:
+        symb.stamp(ctx, 'wood', xoffs+30, top+6, 4)
+    colour = section.colour[i]
+    if colour != '' and hz_pos['colour'] is not None:
+        labels.add(hz_pos['colour'], bot+3, str(colour))
+    if section.contact[i] != '':
+        symb.irregular_contact(ctx, xoffs, bot, width_b)
+    notes = section.notes[i]
+    if notes != '' and hz_pos['notes'] is not None:
+        write_lines(ctx, hz_pos['notes'], bot + 3, 8, notes.split('|'),
+                    labels)
+    if not np.isnan(section.magsus[i]):
+        ms = section.magsus[i] * log_settings.magsus_scale
+        ctx.rectangle(hz_pos['magsus'], top - 4, ms, 8)
+        ctx.set_source_rgb(.8, .8, .8)
+        ctx.fill_preserve()
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.set_line_width(0.5)
+        ctx.stroke()
+    if marks['glc'][j]:
+        for (g_x, g_y) in symb.glc_positions(
+                xoffs, top+log_settings.glc_voffset, width, section.glc[i]):
+            glc_run.add(g_x, g_y, 'g')
+    drill = section.drill[i]
+    if drill != '':
+        drill_xpos = hz_pos['drill'] + \
+            marks['stagger'][j] * log_settings.pmag_stagger
+        if (log_settings.all_drill_sites or
+                drill.lower() in valid_sites):
+            labels.add(drill_xpos, bot + 3 - section.label_offs[i],
+                       str(drill))
+
+
+def draw_beds(ctx, section, page, bot_clip, top_clip, cull=None):
+    """Draw the beds lying between bot_clip and top_clip.
+
+    If cull is a (bot, top) depth range, symbols are still decided for the
+    whole page but only beds overlapping that range are drawn. Symbols and
+    labels are always decided and drawn for the individual beds, even
+    where generalize() merges their lithology.
+    """
+    labels = GlyphRun(ctx)
+    glc_run = GlyphRun(ctx, symb.glc_face())
+    paths = LithPaths()
+    for chunk in chunks(section):
+        width_b, width_t = chunk.widths(log_settings.lith_width)
+        beds = chunk.window(bot_clip, top_clip)
+        tops = page.pos(chunk.top()[beds])
+        bots = page.pos(chunk.bot[beds])
+        marks = declutter(chunk, beds, tops, log_state)
+        marks['lith_bot'], heads = generalize(
+            chunk, beds, tops, bots, log_settings.min_bed_height)
+        drawn = range(len(beds))
+        if cull is not None:
+            in_cull = (chunk.top()[beds] >= cull[0]) & \
+                      (chunk.bot[beds] <= cull[1])
+            # also draw the beds whose polygons cover the culled beds
+            in_cull[heads[in_cull]] = True
+            drawn = np.flatnonzero(in_cull)
+        trace_objects(len(drawn))
+        for j in drawn:
+            i = beds[j]
+            add_bed_lith(ctx, paths, chunk, i, tops[j], width_b[i],
+                         width_t[i], page, marks, j)
+            draw_bed(ctx, paths, chunk, i, tops[j], bots[j], width_b[i],
+                     width_t[i], labels, glc_run, marks, j)
+        paths.draw(ctx)
+        glc_run.show(ctx)
+        labels.show(ctx)
+
+
+def parse_section_file(filename):
+    return Section.parse_columns(read_csv_columns(filename))
 
 
 def read_csv(filename):
+    return Section(cached_columns(filename, parse_section_file))
+
+
+class ChunkIndex:
+    """The depth range of each chunk of a streamed input file.
+
+    The input files aren't sorted by depth, so the ranges are noted on the
+    first full read of a file. Later reads then parse only the chunks
+    reaching into the range from bot_clip to top_clip, and stop after the
+    last of them. Ranges are kept for the life of the process, by file,
+    chunk size, file size and modification time.
+    """
+
+    ranges = {}
+
+    def __init__(self, filename, chunk_size, bot_clip, top_clip):
+        stat = os.stat(filename)
+        self.key = (os.path.abspath(filename), chunk_size, stat.st_size,
+                    stat.st_mtime_ns)
+        self.bot_clip = bot_clip
+        self.top_clip = top_clip
+        self.known = ChunkIndex.ranges.get(self.key)
+        self.noted = []
+        if self.known is not None:
+            wanted = [n for n, (lo, hi) in enumerate(self.known)
+                      if self.overlaps(lo, hi)]
+            self.end = wanted[-1] + 1 if wanted else 0
+
+    def overlaps(self, lo, hi):
+        return lo <= self.top_clip and hi >= self.bot_clip
+
+    def wanted(self, n, depths):
+        """Return whether chunk n reaches into the range; depths() returns
+        the chunk's depths if they are needed."""
+        if self.known is not None:
+            return self.overlaps(*self.known[n])
+        depths = depths()
+        if len(depths):
+            self.noted.append((depths.min(), depths.max()))
+        else:
+            self.noted.append((np.inf, -np.inf))
+        return self.overlaps(*self.noted[-1])
+
+    def done(self, n):
+        """Return whether no chunk after chunk n reaches into the range."""
+        return self.known is not None and n + 1 >= self.end
+
+    def finish(self):
+        """Note the ranges after reading the whole file."""
+        if self.known is None:
+            for key in list(ChunkIndex.ranges):
+                if key[:2] == self.key[:2]:
+                    del ChunkIndex.ranges[key]
+            ChunkIndex.ranges[self.key] = self.noted
+
+
+def iter_csv(filename, chunk_size, bot_clip=-np.inf, top_clip=np.inf):
+    """Read beds from a CSV file as a sequence of Sections.
+
+    Each Section holds at most chunk_size new rows, so memory use does not
+    depend on the length of the file. Only Sections with beds between
+    bot_clip and top_clip are returned; see ChunkIndex.
+    """
+    index = ChunkIndex(filename, chunk_size, bot_clip, top_clip)
     f = open(filename, 'rt')
     r = csv.reader(f)
     headers = next(r)
-    data = []
-    for values in r:
-        data.append(Datum(dict(zip(headers, values))))
+    bot_index = headers.index(float_columns['bot'])
+    above = []
+    n = 0
+    while True:
+        rows = list(islice(r, chunk_size))
+        if not rows:
+            index.finish()
+            break
+        # Drop blank rows here, so that the row carried over to the next
+        # chunk is always a bed.
+        rows = [row for row in rows if row]
+        if not rows:
+            continue
+        if index.wanted(n, lambda: parse_float_column(
+                'bot', [row[bot_index] for row in rows])):
+            yield Section.from_rows(headers, above + rows, len(above))
+        if index.done(n):
+            break
+        above = rows[-1:]
+        n += 1
     f.close()
+
+
+def chunks(data):
+    """Return an iterable of chunks from a whole data set or a stream."""
+    if isinstance(data, (Section, MagSus)):
+        return (data,)
     return data
 
 
@@ -365,62 +977,275 @@ def read_csv_to_list(filename):
     return data
 
 
-def draw_axis(height, ctx, bot, top, interval, scale, offset):
-    x_offs = hz_pos['scale']
-    ctx.move_to(x_offs, (height - bot) * scale)
-    ctx.line_to(x_offs, (height - top) * scale)
-    ctx.set_line_width(1)
-    ctx.set_source_rgb(0, 0, 0)
+class Sites:
+    """Palaeomagnetic site results, held as columns and indexed by height.
+
+    height, dec, inc, a95 and k are float arrays (NaN where missing), and
+    text holds every column of the file as strings. block gives the
+    position in pmag_blocks of each site's block, or -1 if it is not in
+    one, and block_row its row within the block; blocked lists the
+    blocked sites in the order they are tabulated.
+    """
+
+    numeric = ('height', 'dec', 'inc', 'a95', 'k')
+
+    def __init__(self, columns, blocks=pmag_blocks,
+                 breaks=decinc_graph_breaks):
+        self.text = dict((name, np.asarray(values, dtype=str))
+                         for name, values in columns.items())
+        self.site = self.text['site']
+        n = len(self.site)
+        for name in self.numeric:
+            setattr(self, name, parse_floats(
+                self.text.get(name, np.full(n, '')), np.nan))
+        self.index = DepthIndex(self.height)
+        position = dict((site, i) for i, site in enumerate(self.site))
+        self.block = np.full(n, -1)
+        self.block_row = np.zeros(n, dtype=int)
+        self.block_heights = np.array(list(blocks.values()), dtype=float)
+        blocked = []
+        for b, block in enumerate(blocks):
+            for row, site in enumerate(block):
+                if site in position:
+                    i = position[site]
+                    self.block[i] = b
+                    self.block_row[i] = row
+                    blocked.append(i)
+        self.blocked = np.array(blocked, dtype=int)
+        self.breaks = np.isin(self.site, list(breaks))
+
+    def __len__(self):
+        return len(self.site)
+
+    def window(self, bot_clip, top_clip):
+        """Return the positions of the sites within a depth range."""
+        return self.index.window(bot_clip, top_clip)
+
+    def window_text(self, bot_clip, top_clip):
+        """Return the text of the sites within a depth range, by column."""
+        rows = self.window(bot_clip, top_clip)
+        return dict((name, values[rows].tolist())
+                    for name, values in self.text.items())
+
+    def table_positions(self, bot_clip, top_clip):
+        """Return the sites to tabulate in a depth range, and their heights.
+
+        Sites outside blocks are placed at their own heights. Sites in a
+        block are listed below the block's height, one row (in 10 pt
+        steps, returned as the second array) per site.
+        """
+        single = self.window(bot_clip, top_clip)
+        single = single[self.block[single] < 0]
+        h0 = self.block_heights[self.block[self.blocked]]
+        blocked = self.blocked[(h0 >= bot_clip) & (h0 <= top_clip)]
+        sites = np.concatenate((single, blocked))
+        heights = np.concatenate((self.height[single],
+                                  self.block_heights[self.block[blocked]]))
+        rows = np.concatenate((np.zeros(len(single), dtype=int),
+                               self.block_row[blocked]))
+        return sites, heights, rows
+
+
+def read_sites(filename):
+    return Sites(cached_columns(filename, read_csv_columns))
+
+
+# Recordings of page furniture, by layout, least recently used first
+furniture = OrderedDict()
+furniture_size = 64
+
+
+def draw_recorded(ctx, key, draw, x=0, y=0):
+    """Draw furniture which is the same on every page of a layout by
+    replaying a recording of it, offset by (x, y).
+
+    draw(ctx) is called to record the furniture the first time a key is
+    used. The recording starts from the font and line width of ctx,
+    which are added to the key. As with symb.stamp, each recording is
+    emitted once as a shared form object in PDF output, and the state of
+    ctx is left unchanged. At most furniture_size recordings are kept.
+    """
+    key = (key, font_key(ctx), ctx.get_line_width())
+    if key in furniture:
+        furniture.move_to_end(key)
+    else:
+        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+        recorder = cairo.Context(surface)
+        recorder.set_font_face(ctx.get_font_face())
+        recorder.set_font_matrix(ctx.get_font_matrix())
+        recorder.set_line_width(ctx.get_line_width())
+        draw(recorder)
+        furniture[key] = surface
+        if len(furniture) > furniture_size:
+            furniture.popitem(last=False)
+    ctx.save()
+    ctx.set_source_surface(furniture[key], x, y)
+    ctx.paint()
+    ctx.restore()
+
+
+def draw_axis_ticks(ctx, x_offs, y_bot, y_top, ys):
+    ctx.move_to(x_offs, y_bot)
+    ctx.line_to(x_offs, y_top)
     ctx.stroke()
-    nticks = int(round((top - bot) / interval + 1))
-    for i in range(0, nticks):
-        y = (height - (bot + i * interval)) * scale
+    for y in ys:
         ctx.move_to(x_offs, y)
         ctx.rel_line_to(-4, 0)
         ctx.stroke()
+
+
+def draw_axis(ctx, page, bot_clip, top_clip, interval):
+    x_offs = hz_pos['scale']
+    ctx.set_line_width(1)
+    ctx.set_source_rgb(0, 0, 0)
+    # ticks at the multiples of interval within the range
+    first = int(np.ceil(bot_clip / interval))
+    last = int(np.floor(top_clip / interval))
+    ticks = np.arange(first, last + 1) * interval
+    ys = page.pos(ticks).tolist()
+    y_top = page.pos(top_clip)
+    # Only the tick labels differ between pages of the same length, scale,
+    # interval and tick offset, so the ticks are recorded relative to the
+    # top of the axis and the recording is shared by all such pages.
+    draw_recorded(ctx, ('axis', x_offs, top_clip - bot_clip, page.length(1),
+                        interval, top_clip - last * interval),
+                  partial(draw_axis_ticks, x_offs=x_offs,
+                          y_bot=page.length(top_clip - bot_clip), y_top=0,
+                          ys=[y - y_top for y in ys]),
+                  0, y_top)
+    for tick, y in zip(ticks.tolist(), ys):
         ctx.move_to(x_offs - 18, y + 3.5)
-        ctx.show_text(str(int((offset + i * interval) / 100)))
+        ctx.show_text('%g' % (tick / 100))
+
+
+class MagSus:
+    """A magnetic susceptibility series, indexed by height.
+
+    levels[0] is the series itself; each following level halves the number
+    of points by replacing every run of four points with its minimum and
+    maximum, in their original order, so the envelope of the curve is kept
+    at every level. Levels are built as they are first needed.
+    """
+
+    def __init__(self, height, value):
+        self.height = height
+        self.value = value
+        self.index = DepthIndex(height)
+        self.levels = [self]
+
+    def window(self, bot_clip, top_clip):
+        i = self.index.window(bot_clip, top_clip)
+        return self.height[i], self.value[i]
+
+    def decimate(self):
+        n = len(self.value) // 4 * 4
+        h = self.height[:n].reshape(-1, 4)
+        v = self.value[:n].reshape(-1, 4)
+        i_min = v.argmin(axis=1)
+        i_max = v.argmax(axis=1)
+        pair = np.column_stack((np.minimum(i_min, i_max),
+                                np.maximum(i_min, i_max)))
+        rows = np.arange(len(v))[:, np.newaxis]
+        return MagSus(np.concatenate((h[rows, pair].ravel(), self.height[n:])),
+                      np.concatenate((v[rows, pair].ravel(), self.value[n:])))
+
+    def for_scale(self, scale, resolution):
+        """Return the coarsest level whose points are at least resolution
+        points apart on a page of the given scale."""
+        if len(self.height) < 2:
+            return self
+        spacing = (self.height.max() - self.height.min()) / \
+            (len(self.height) - 1) * scale
+        level = 0
+        while spacing * 2 ** (level + 1) <= resolution and \
+                len(self.levels[level].value) >= 8:
+            if len(self.levels) == level + 1:
+                self.levels.append(self.levels[level].decimate())
+            level += 1
+        return self.levels[level]
+
+
+def parse_magsus_columns(lines):
+    """Parse lines of tab-separated height and magsus values into arrays."""
+    try:
+        table = np.loadtxt(lines, delimiter='\t', usecols=(0, 1), ndmin=2)
+    except (ValueError, IndexError):
+        # some lines are incomplete: fall back to parsing line by line
+        table = np.array([line.strip().split('\t') for line in lines
+                          if len(line.strip().split('\t')) >= 2],
+                         dtype=float).reshape(-1, 2)
+    return {'height': table[:, 0], 'value': table[:, 1]}
+
+
+def parse_magsus(lines):
+    columns = parse_magsus_columns(lines)
+    return MagSus(columns['height'], columns['value'])
+
+
+def parse_magsus_file(filename):
+    f = open(filename, 'r')
+    columns = parse_magsus_columns(f.readlines())
+    f.close()
+    return columns
 
 
 def read_magsus(filename):
-    ms = []
+    columns = cached_columns(filename, parse_magsus_file)
+    return MagSus(columns['height'], columns['value'])
+
+
+def iter_magsus(filename, chunk_size, bot_clip=-np.inf, top_clip=np.inf):
+    """Read a magnetic susceptibility file as a sequence of MagSus chunks.
+
+    As for iter_csv, only chunks with points between bot_clip and
+    top_clip are returned.
+    """
+    index = ChunkIndex(filename, chunk_size, bot_clip, top_clip)
     f = open(filename, 'r')
-    for line in f.readlines():
-        parts = line.strip().split('\t')
-        if len(parts) < 2:
-            continue
-        height, magsus = parts
-        ms.append((float(height), float(magsus)))
-    return ms
+    n = 0
+    while True:
+        lines = list(islice(f, chunk_size))
+        if not lines:
+            index.finish()
+            break
+        chunk = None
+        if index.known is None:
+            chunk = parse_magsus(lines)
+        if index.wanted(n, lambda: chunk.height):
+            yield parse_magsus(lines) if chunk is None else chunk
+        if index.done(n):
+            break
+        n += 1
+    f.close()
 
 
-def draw_magsus(ctx, height, bot_clip, top_clip, scale, yoffs, ms_values):
+def draw_magsus(ctx, page, bot_clip, top_clip, ms_values):
     ctx.set_line_width(0.5)
     x_offs = hz_pos['magsus']
     first = True
-    # ctx.move_to(x_offs, (height+yoffs-bot_clip)*scale)
-    # ctx.line_to(x_offs, (height+yoffs-top_clip)*scale)
     scale_lines = 5
     real_width = 40.
     dist_per_line = real_width / (scale_lines-1)
     for i in range(0, scale_lines):
         dist = i * dist_per_line
-        ctx.move_to(x_offs + dist, (height + yoffs - bot_clip) * scale)
-        ctx.line_to(x_offs + dist, (height + yoffs - top_clip) * scale)
+        ctx.move_to(x_offs + dist, page.pos(bot_clip))
+        ctx.line_to(x_offs + dist, page.pos(top_clip))
     ctx.stroke()
     y = 0
     first_y = 0
-    for (h, ms) in ms_values:
-        if h < bot_clip or h > top_clip:
-            continue
-        y = (height - h + yoffs) * scale
-        x = x_offs + ms * log_settings.magsus_scale
-        if first:
-            ctx.move_to(x_offs, y)
-            first_y = y
-            # ctx.move_to(x, y)
-            first = False
-        ctx.line_to(x, y)
+    for chunk in chunks(ms_values):
+        chunk = chunk.for_scale(page.length(1),
+                                log_settings.magsus_resolution)
+        heights, values = chunk.window(bot_clip, top_clip)
+        trace_objects(len(heights))
+        xs = x_offs + values * log_settings.magsus_scale
+        for (x, y) in zip(xs.tolist(), page.pos(heights).tolist()):
+            if first:
+                ctx.move_to(x_offs, y)
+                first_y = y
+                # ctx.move_to(x, y)
+                first = False
+            ctx.line_to(x, y)
     ctx.line_to(x_offs, y)
     ctx.line_to(x_offs, first_y)
     ctx.close_path()
@@ -430,13 +1255,13 @@ def draw_magsus(ctx, height, bot_clip, top_clip, scale, yoffs, ms_values):
     ctx.stroke()
 
 
-def draw_formation(ctx, height, bot_clip, top_clip, scale, yoffs, name, bot,
-                   top):
+def draw_formation(ctx, page, bot_clip, top_clip, name, bot, top):
     if top > top_clip or bot < bot_clip:
         return
+    trace_objects(1)
     ctx.set_line_width(0.5)
-    y = (height - top + yoffs) * scale
-    h = (top - bot) * scale
+    y = page.pos(top)
+    h = page.length(top - bot)
     ctx.rectangle(hz_pos['fmn'], y, 15, h)
     ctx.set_source_rgb(0, 0, 0)
     ctx.stroke()
@@ -447,65 +1272,58 @@ def draw_formation(ctx, height, bot_clip, top_clip, scale, yoffs, name, bot,
     ctx.restore()
 
 
-def draw_decsincs_table(ctx, height, bot_clip, top_clip, scale, yoffs):
-    def write_decinc(datum, y):
-        align_text(ctx, hz_pos['drill2'], y, datum['site'], 'l', 'c')
-        align_text(ctx, hz_pos['dec'], y, datum['dec'], 'r', 'c')
-        align_text(ctx, hz_pos['inc'], y, datum['inc'], 'r', 'c')
-    for site, datum in log_settings.decs_incs.items():
-        in_block = False
-        for pmag_block in pmag_blocks.keys():
-            if site in pmag_block:
-                in_block = True
-        h = float(datum['height'])
-        y = (height-h+yoffs)*scale
-        if not in_block:
-            write_decinc(datum, y)
-    for pmag_block, h0 in pmag_blocks.items():
-        y0 = (height-h0+yoffs)*scale
-        for i in range(len(pmag_block)):
-            y = y0 + i * 10
-            site = pmag_block[i]
-            write_decinc(log_settings.decs_incs[site], y)
-
-
-def draw_decsincs_graph(ctx, height, bot_clip, top_clip, scale, yoffs):
+def draw_decsincs_table(ctx, page, bot_clip, top_clip):
+    sites = log_settings.decs_incs_list
+    indices, heights, rows = sites.table_positions(bot_clip, top_clip)
+    ys = page.pos(heights) + rows * 10
+    for i, y in zip(indices.tolist(), ys.tolist()):
+        align_text(ctx, hz_pos['drill2'], y, sites.site[i], 'l', 'c')
+        align_text(ctx, hz_pos['dec'], y, sites.text['dec'][i], 'r', 'c')
+        align_text(ctx, hz_pos['inc'], y, sites.text['inc'][i], 'r', 'c')
+
+
+def draw_decsincs_graph(ctx, page, bot_clip, top_clip):
+    sites = log_settings.decs_incs_list
+    window = sites.window(bot_clip, top_clip)
+    ys = page.pos(sites.height[window]).tolist()
+    breaks = sites.breaks[window].tolist()
+
     def draw_param(param_name, p_scale, grid_lines):
         x_offs = hz_pos[param_name+'_g']
         ctx.set_line_width(0.5)
         for grid_line in grid_lines:
             dist = x_offs + grid_line * p_scale
-            ctx.move_to(dist, (height + yoffs - bot_clip) * scale)
-            ctx.line_to(dist, (height + yoffs - top_clip) * scale)
+            ctx.move_to(dist, page.pos(bot_clip))
+            ctx.line_to(dist, page.pos(top_clip))
             ctx.stroke()
         for i in (0, len(grid_lines)-1):
             align_text(ctx, x_offs + grid_lines[i] * p_scale,
-                       (height + yoffs - top_clip) * scale - 2,
+                       page.pos(top_clip) - 2,
                        str(grid_lines[i]), 'c', 't')
         ctx.set_source_rgb(0., 0., 0.)
-        for style in (0, 1):  # lines, dots
-            for datum in log_settings.decs_incs_list:
-                h = float(datum['height'])
-                param = float(datum[param_name])
-                y = (height - h + yoffs) * scale
-                x = x_offs + param * p_scale
-                if style == 1:
-                    ctx.set_line_width(0.5)
-                    ctx.arc(x, y, 1.5, 0, 2*pi)
-                    ctx.stroke()
-                    # ctx.fill()
-                if style == 0:
-                    if datum['site'] in decinc_graph_breaks:
-                        ctx.move_to(x, y)
-                    else:
-                        ctx.line_to(x, y)
-            if style == 0:
-                ctx.set_line_width(1.0)
-                ctx.stroke()
+        trace_objects(len(window))
+        xs = (x_offs + getattr(sites, param_name)[window] * p_scale).tolist()
+        for x, y, brk in zip(xs, ys, breaks):  # lines
+            if brk:
+                ctx.move_to(x, y)
+            else:
+                ctx.line_to(x, y)
+        ctx.set_line_width(1.0)
+        ctx.stroke()
+        for x, y in zip(xs, ys):  # dots
+            ctx.set_line_width(0.5)
+            ctx.arc(x, y, 1.5, 0, 2*pi)
+            ctx.stroke()
     draw_param('dec', 0.16, (0, 90, 180, 270, 360))
     draw_param('inc', 0.4, (0, 30, 60, 90))
 
 
+def header_layout():
+    """Return a key for everything that the header depends on."""
+    return ('header', tuple(sorted(hz_pos.items())), log_settings.lith_width,
+            log_settings.decs_incs_list is not None, log_settings.currents)
+
+
 def draw_header(ctx, ypos):
     global log_settings
     ctx.move_to(hz_pos['scale']-20, ypos)
@@ -556,8 +1374,10 @@ def draw_direction(ctx, x, y, radius, direction):
 
 
 def draw_currents(ctx, x_pos, page, currents):
+    trace_objects(len(currents))
+    labels = GlyphRun(ctx)
     for (bottom, top, direction) in currents:
-        print(bottom)
+        logger.debug('current interval from %s to %s', bottom, top)
         ctx.move_to(x_pos, page.scale.pos(bottom))
         ctx.line_to(x_pos + 4, page.scale.pos(bottom))
         ctx.line_to(x_pos + 4, page.scale.pos(top))
@@ -565,18 +1385,19 @@ def draw_currents(ctx, x_pos, page, currents):
         ctx.stroke()
         if direction is None:
             write_lines(ctx, x_pos + 8, page.scale.pos((bottom + top) / 2) - 12,
-                        10, 'No current detected'.split())
+                        10, 'No current detected'.split(), labels)
         elif isinstance(direction, str):
             write_lines(ctx, x_pos + 8, page.scale.pos((bottom + top) / 2) - 12,
-                        10, direction.split('|'))
+                        10, direction.split('|'), labels)
         else:
             draw_direction(ctx, x_pos + 17, page.scale.pos((bottom + top) / 2),
                            10, direction)
+    labels.show(ctx)
 
 
 def draw_annotation(ctx, x_pos, page, annotation):
     (height, text) = annotation
-    print(height, text)
+    logger.debug('annotation %r at %s', text, height)
     width = 135
     ctx.set_line_width(2.)
     ctx.set_source_rgb(.3, .3, .3)
@@ -587,56 +1408,268 @@ def draw_annotation(ctx, x_pos, page, annotation):
     align_text(ctx, x_pos + width + 2, page.scale.pos(height), text, 'l', 'c')
 
 
-def draw_page(bot_clip, top_clip, ds, ms_values, scale, formations,
-              legend=None, filename=None, current_data=None,
-              annotation=None):
-    global last_glc_height, log_settings
-    last_glc_height = None
-    height = top_clip - bot_clip
-    top_margin = 24
-    bot_margin = 5
-    total_height_pt = scale * height + top_margin + bot_margin
-    if filename is None:
-        filename = 'output/ffq%04d' % bot_clip
-    if log_settings.pdf_output:
-        surface = cairo.PDFSurface(filename + '.pdf', mm_to_pt(160),
-                                   total_height_pt)
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+logger = logging.getLogger('sedlog')
+
+# Functions called with the trace of every page drawn by draw_page, as a
+# dict; page traces are also logged as JSON at the TRACE level.
+trace_hooks = []
+render_trace = None
+
+path_ops = {'move_to', 'line_to', 'rel_move_to', 'rel_line_to', 'curve_to',
+            'rel_curve_to', 'arc', 'arc_negative', 'rectangle', 'close_path'}
+draw_ops = {'fill', 'fill_preserve', 'stroke', 'stroke_preserve', 'paint',
+            'mask', 'clip'}
+text_ops = {'show_text', 'show_glyphs', 'text_path'}
+
+
+class CountingContext:
+    """A wrapper for a cairo Context that counts the calls made on it."""
+
+    def __init__(self, ctx, counts):
+        self._ctx = ctx
+        self._counts = counts
+
+    def __getattr__(self, name):
+        method = getattr(self._ctx, name)
+        if name in path_ops:
+            kind = 'path_ops'
+        elif name in draw_ops:
+            kind = 'draw_ops'
+        elif name in text_ops:
+            kind = 'text_ops'
+        else:
+            kind = 'other_ops'
+        counts = self._counts
+
+        def counted(*args, **kwargs):
+            counts[kind] += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+class RenderTrace:
+    """Timings and operation counts for the columns of one page, and the
+    text_metrics lookups made while drawing it."""
+
+    def __init__(self, page):
+        self.page = page
+        self.columns = OrderedDict()
+        self.current = None
+        self.metrics_start = (text_metrics.hits, text_metrics.misses)
+
+    @contextmanager
+    def column(self, name, ctx):
+        counts = self.columns.setdefault(
+            name, {'seconds': 0., 'path_ops': 0, 'draw_ops': 0,
+                   'text_ops': 0, 'other_ops': 0, 'objects': 0})
+        self.current = counts
+        start = time.perf_counter()
+        try:
+            yield CountingContext(ctx, counts) if ctx is not None else None
+        finally:
+            counts['seconds'] += time.perf_counter() - start
+            self.current = None
+
+    def as_dict(self):
+        hits, misses = self.metrics_start
+        return {'page': self.page, 'columns': self.columns,
+                'seconds': sum(c['seconds'] for c in self.columns.values()),
+                'text_metrics': {'hits': text_metrics.hits - hits,
+                                 'misses': text_metrics.misses - misses}}
+
+
+def tracing():
+    return bool(trace_hooks) or logger.isEnabledFor(TRACE)
+
+
+def start_trace(name):
+    global render_trace
+    if tracing():
+        render_trace = RenderTrace(name)
+
+
+def emit_trace():
+    if render_trace is not None:
+        trace = render_trace.as_dict()
+        logger.log(TRACE, json.dumps(trace))
+        for hook in trace_hooks:
+            hook(trace)
+
+
+def end_trace():
+    global render_trace
+    render_trace = None
+
+
+@contextmanager
+def traced(name, ctx=None):
+    """Run a block as the named column of the current page trace.
+
+    Yields a context to draw with, which counts operations if the page
+    is being traced.
+    """
+    if render_trace is None:
+        yield ctx
     else:
-        surface = cairo.SVGSurface(filename + '.svg', mm_to_pt(160),
-                                   total_height_pt)
-    ctx = cairo.Context(surface)
-    ctx.select_font_face(log_settings.font_name)
+        with render_trace.column(name, ctx) as counting_ctx:
+            yield counting_ctx
+
+
+def trace_objects(n):
+    """Add n to the number of objects drawn by the current column."""
+    if render_trace is not None and render_trace.current is not None:
+        render_trace.current['objects'] += n
+
+
+top_margin = 24
+bot_margin = 5
+page_width = mm_to_pt(160)
+
+
+def page_height(bot_clip, top_clip, scale):
+    return scale * (top_clip - bot_clip) + top_margin + bot_margin
+
+
+def draw_page_content(ctx, bot_clip, top_clip, section, ms_values, scale,
+                      formations, legend=None, current_data=None,
+                      annotation=None, cull=None):
+    log_state.last_glc_height = None
+    page = Page.for_log(bot_clip, top_clip, scale)
+    ctx.set_font_face(fonts.face(log_settings.font_name))
     
     if annotation is not None:
-        draw_annotation(ctx, 20, annotation[0], annotation[1])
+        with traced('annotation', ctx) as c:
+            draw_annotation(c, 20, annotation[0], annotation[1])
 
-    draw_magsus(ctx, height + top_margin/scale, bot_clip, top_clip, scale,
-                bot_clip, ms_values)
+    with traced('magsus', ctx) as c:
+        draw_magsus(c, page, bot_clip, top_clip, ms_values)
 
-    for i in range(0, len(ds)):
-        if i > 0:
-            above = ds[i - 1]
-        else:
-            above = None
-        d = ds[i]
-        if d.bot >= bot_clip and d.bot + d.thick <= top_clip:
-            ds[i].draw(height + top_margin/scale, ctx, scale, above, bot_clip)
-    
-    draw_axis(height + top_margin/scale, ctx, 0., height, 100., scale, bot_clip)
-    draw_header(ctx, top_margin-10)
+    with traced('lithology', ctx) as c:
+        draw_beds(c, section, page, bot_clip, top_clip, cull)
+
+    with traced('axis', ctx) as c:
+        draw_axis(c, page, bot_clip, top_clip, 100.)
+    with traced('header', ctx) as c:
+        draw_recorded(c, header_layout(),
+                      partial(draw_header, ypos=top_margin-10))
     if log_settings.decs_incs_list is not None:
-        draw_decsincs_graph(ctx, height + top_margin/scale,
-                            bot_clip, top_clip, scale,
-                            bot_clip)
-    for (name, bot, top) in formations:
-        draw_formation(ctx, height + top_margin / scale, bot_clip, top_clip,
-                       scale, bot_clip, name, bot, top)
+        with traced('decinc_graph', ctx) as c:
+            draw_decsincs_graph(c, page, bot_clip, top_clip)
+    with traced('formations', ctx) as c:
+        for (name, bot, top) in formations:
+            draw_formation(c, page, bot_clip, top_clip, name, bot, top)
     if current_data is not None:
-        page, currents = current_data
-        draw_currents(ctx, 400, page, currents)
+        current_page, currents = current_data
+        with traced('currents', ctx) as c:
+            draw_currents(c, 400, current_page, currents)
+    if legend is not None:
+        with traced('legend', ctx) as c:
+            draw_recorded(c, ('legend', log_settings.font_name),
+                          partial(draw_legend, xo=0, yo=0), *legend)
+
+
+def draw_page(bot_clip, top_clip, section, ms_values, scale, formations,
+              legend=None, filename=None, current_data=None,
+              annotation=None, target=None):
+    """Draw a page to a file, or to target (a filename or a writable
+    binary file object) if given."""
+    total_height_pt = page_height(bot_clip, top_clip, scale)
+    if filename is None:
+        filename = 'output/ffq%04d' % bot_clip
+    if log_settings.pdf_output:
+        if target is None:
+            target = filename + '.pdf'
+        surface = cairo.PDFSurface(target, page_width, total_height_pt)
+    else:
+        if target is None:
+            target = filename + '.svg'
+        surface = cairo.SVGSurface(target, page_width, total_height_pt)
+    start_trace(filename)
+    try:
+        ctx = cairo.Context(surface)
+        draw_page_content(ctx, bot_clip, top_clip, section, ms_values, scale,
+                          formations, legend, current_data, annotation)
+        with traced('finish'):
+            surface.finish()
+        emit_trace()
+    finally:
+        end_trace()
+
+
+def page_windows(bot_clip, top_clip, page_length):
+    """Split a depth range into windows of at most page_length, starting
+    from the top."""
+    windows = []
+    top = top_clip
+    while top > bot_clip:
+        bot = max(bot_clip, top - page_length)
+        windows.append((bot, top))
+        top = bot
+    return windows
+
+
+def clip_formations(formations, bot_clip, top_clip):
+    """Cut formations down to the parts lying within a depth range."""
+    clipped = []
+    for (name, bot, top) in formations:
+        if bot < top_clip and top > bot_clip:
+            clipped.append((name, max(bot, bot_clip), min(top, top_clip)))
+    return clipped
+
+
+def draw_document(bot_clip, top_clip, page_length, section, ms_values, scale,
+                  formations, legend=None, filename=None, current_data=None,
+                  annotation=None, target=None):
+    """Draw a depth range as a single PDF of pages page_length cm high.
+
+    Fonts, patterns and symbols are shared by all the pages in the file.
+    Formations are cut at page boundaries; the legend, if any, is drawn on
+    the first page, which is lengthened if need be to hold it. section
+    and ms_values may be functions returning streams of the data in a
+    depth range, which are then opened afresh for each page. As for
+    draw_page, target overrides the output file. Currents and annotations
+    are placed by their own Page for one whole page, so they can't be
+    split.
+    """
+    if not log_settings.pdf_output:
+        raise ValueError('multi-page output is only supported for PDF')
+    if current_data is not None or annotation is not None:
+        raise ValueError('multi-page output does not support currents or '
+                         'annotations')
+    if filename is None:
+        filename = 'output/ffq%04d' % bot_clip
+    if target is None:
+        target = filename + '.pdf'
+    windows = page_windows(bot_clip, top_clip, page_length)
+    heights = [page_height(bot, top, scale) for (bot, top) in windows]
     if legend is not None:
-        draw_legend(ctx, *legend)
-    surface.finish()
+        heights[0] = max(heights[0], legend[1] + legend_height)
+    surface = cairo.PDFSurface(target, page_width, heights[0])
+    try:
+        ctx = cairo.Context(surface)
+        for page_number, (bot, top) in enumerate(windows):
+            # each page gets its own trace, and the file as a whole another
+            # for writing it out
+            start_trace('%s#%d' % (filename, page_number + 1))
+            surface.set_size(page_width, heights[page_number])
+            draw_page_content(
+                ctx, bot, top,
+                section(bot, top) if callable(section) else section,
+                ms_values(bot, top) if callable(ms_values) else ms_values,
+                scale,
+                clip_formations(formations, bot, top),
+                legend if page_number == 0 else None)
+            ctx.show_page()
+            emit_trace()
+            end_trace()
+        start_trace(filename)
+        with traced('finish'):
+            surface.finish()
+        emit_trace()
+    finally:
+        end_trace()
 
 
 def draw_pattern_box(ctx, x, y, w, h, pattern, text):
@@ -684,13 +1717,19 @@ def legend_features(ctx, xo, yo):
     y += step
 
 
+legend_height = 300  # extent of the legend below its offset, in points
+
+
 def draw_legend(ctx, xo, yo):
     ctx.save()
     ctx.translate(xo, yo)
-    ctx.select_font_face(log_settings.font_name)
-    draw_pattern_box(ctx, 10, 10, 50, 36, liths['sist'], 'Siltstone')
-    draw_pattern_box(ctx, 10, 50, 50, 36, liths['sst'], 'Sandstone')
-    draw_pattern_box(ctx, 10, 90, 50, 36, burrow_pattern, 'Burrow mottling')
+    ctx.set_font_face(fonts.face(log_settings.font_name))
+    draw_pattern_box(ctx, 10, 10, 50, 36, symb.get_pattern('silt'),
+                     'Siltstone')
+    draw_pattern_box(ctx, 10, 50, 50, 36, symb.get_pattern('sand'),
+                     'Sandstone')
+    draw_pattern_box(ctx, 10, 90, 50, 36, symb.get_pattern('burrow'),
+                     'Burrow mottling')
     symb.irregular_contact(ctx, 10, 140, 50)
     ctx.move_to(64, 142)
     ctx.show_text('Irregular/burrowed contact')
@@ -699,45 +1738,729 @@ def draw_legend(ctx, xo, yo):
     ctx.restore()
 
 
-def main():
-    ds = read_csv('input-data/sed-data.csv')
-    ms_values = read_magsus('input-data/ms.txt')
+class PageJob:
+    """A self-contained description of one output page.
+
+    settings and hz_pos hold overrides applied to fresh copies of the
+    defaults when the job is rendered, so jobs don't depend on each other
+    or on the order in which they run. If page_length is set, the depth
+    range is split into pages of that many cm in a single PDF file.
+    """
+
+    def __init__(self, bot, top, scale, formations, filename=None,
+                 settings=None, hz_pos=None, legend=None, current_data=None,
+                 annotation=None, page_length=None):
+        self.bot = bot
+        self.top = top
+        self.scale = scale
+        self.formations = formations
+        if filename is None:
+            filename = 'output/ffq%04d' % bot
+        self.filename = filename
+        self.settings = {} if settings is None else settings
+        self.hz_pos = {} if hz_pos is None else hz_pos
+        self.legend = legend
+        self.current_data = current_data
+        self.annotation = annotation
+        self.page_length = page_length
+
+    def cost(self):
+        # Rough rendering cost: the page height in points.
+        return (self.top - self.bot) * self.scale
+
+
+summary_settings = {
+    'fmn_name_offset': -2,
+    'stagger_pmag': True,
+    'glc_voffset': 10,
+    'glc_int': 49,
+    'glc_int_2': 31,
+    'min_bed_height': 2
+}
+
+summary_hz_pos = {'colour': None, 'notes': None}
+
+
+def page_jobs():
+    jobs = []
     intervals = (2100, 2400, 2700, 3000)
     for i in range(0, len(intervals) - 1):
-        draw_page(intervals[i], intervals[i + 1], ds, ms_values, 2, fmns_paged)
+        jobs.append(PageJob(intervals[i], intervals[i + 1], 2, fmns_paged))
     intervals = (500, 1300, 2100)
     for i in range(0, len(intervals) - 1):
         legend = None
         if i == 0:
             legend = (270, 320)
-        draw_page(intervals[i], intervals[i+1], ds, ms_values, 0.75,
-                  fmns_paged, legend=legend)
-    global log_settings, hz_pos
-    log_settings.fmn_name_offset = -2
-    log_settings.stagger_pmag = True
-    log_settings.glc_voffset = 10
-    log_settings.glc_int = 49
-    log_settings.glc_int_2 = 31
-    hz_pos['colour'] = None
-    hz_pos['notes'] = None
-    draw_page(500, 3000, ds, ms_values, 0.24, fmns_summary,
-              legend=(280, 220), filename='output/ffq-log-entire')
-    log_settings.all_drill_sites = False
-    hz_pos_new = {}
-    for col, pos in hz_pos.items():
-        if col != 'scale' and pos is not None:
-            pos += 34
-        hz_pos_new[col] = pos
-    # hz_pos = hz_pos_new # uncomment to shunt columns rightward
-    # log_settings.decs_incs_dict = read_csv_to_dicts('site-incdec.csv')
-    log_settings.decs_incs_list = read_csv_to_list('input-data/site-incdec.csv')
+        jobs.append(PageJob(intervals[i], intervals[i + 1], 0.75, fmns_paged,
+                            legend=legend))
+    jobs.append(PageJob(500, 3000, 0.24, fmns_summary,
+                        filename='output/ffq-log-entire',
+                        settings=summary_settings, hz_pos=summary_hz_pos,
+                        legend=(280, 220)))
+    # To shunt columns rightward, add 34 to every hz_pos entry except
+    # 'scale' in the hz_pos overrides below.
+    settings = dict(summary_settings)
+    settings['all_drill_sites'] = False
+    settings['decs_incs_list'] = read_sites('input-data/site-incdec.csv')
+    settings['currents'] = True
+    # carry on the staggering from ffq-log-entire, as this page was once
+    # drawn straight after it
+    settings['first_pmag_stagger'] = 2
     currents = ((5.5, 7.45, 354.8), (7.55, 8.95, 137.3), (9.05, 11.95, 272.8),
                 (12.05, 29.5, 'Inverse|AMS|fabric'))
     page = Page(29.5, 5.5, mm_to_pt(12), mm_to_pt(215))
-    log_settings.currents = True
-    draw_page(500, 3000, ds, ms_values, 0.24, fmns_summary,
-              filename='output/ffq-log-entire-2', current_data=(page, currents),
-              annotation=(page, (21.2, 'K-Pg')))
+    jobs.append(PageJob(500, 3000, 0.24, fmns_summary,
+                        filename='output/ffq-log-entire-2',
+                        settings=settings, hz_pos=summary_hz_pos,
+                        current_data=(page, currents),
+                        annotation=(page, (21.2, 'K-Pg'))))
+    return jobs
+
+
+# Set to a number of rows to stream the input files through the renderer
+# in chunks of that size, rather than reading them whole.
+stream_chunk_size = None
+
+worker_data = {}
+
+
+def init_worker(section, ms_values):
+    worker_data['section'] = section
+    worker_data['ms_values'] = ms_values
+
+
+def configure_job(job):
+    """Set up the global settings for a job."""
+    global log_settings, log_state, hz_pos
+    log_settings = LogSettings()
+    for name, value in job.settings.items():
+        setattr(log_settings, name, value)
+    log_state = LogState()
+    log_state.pmag_stagger = log_settings.first_pmag_stagger
+    hz_pos = make_hz_pos(job.hz_pos)
+
+
+def start_job(job):
+    """Set up the global settings for a job and return its input data."""
+    section = worker_data['section']
+    ms_values = worker_data['ms_values']
+    if callable(section):
+        # streamed input: open a fresh stream for this page
+        section = section(job.bot, job.top)
+        ms_values = ms_values(job.bot, job.top)
+    configure_job(job)
+    return section, ms_values
+
+
+# Rendering uses module-level settings, so only one thread may render at a
+# time.
+render_lock = threading.Lock()
+
+
+def draw_png(bot_clip, top_clip, section, ms_values, scale, formations,
+             target, ppi=72, legend=None, current_data=None,
+             annotation=None):
+    """Draw a page as a PNG image at ppi pixels per inch to target (a
+    filename or a writable binary file object)."""
+    zoom = ppi / 72
+    surface = cairo.ImageSurface(
+        cairo.FORMAT_ARGB32, int(ceil(page_width * zoom)),
+        int(ceil(page_height(bot_clip, top_clip, scale) * zoom)))
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    ctx.scale(zoom, zoom)
+    ctx.set_source_rgb(0, 0, 0)
+    draw_page_content(ctx, bot_clip, top_clip, section, ms_values, scale,
+                      formations, legend, current_data, annotation)
+    surface.flush()
+    surface.write_to_png(target)
+
+
+def render_page(job, section, ms_values, stream=None, output_format=None,
+                ppi=72):
+    """Render a job in memory rather than to its output file.
+
+    The output is written to stream, a writable binary file object, if
+    given; otherwise it is returned as bytes. section and ms_values are
+    the input data, or functions returning streams of the data in a depth
+    range. output_format may be 'pdf', 'svg' or 'png' (at ppi pixels per
+    inch); by default it follows the job's pdf_output setting.
+    """
+    if output_format == 'png' and job.page_length is not None:
+        raise ValueError('PNG output has only one page')
+    buffer = io.BytesIO() if stream is None else stream
+    with render_lock:
+        configure_job(job)
+        if output_format in ('pdf', 'svg'):
+            log_settings.pdf_output = output_format == 'pdf'
+        elif output_format not in (None, 'png'):
+            raise ValueError('unknown output format %r' % output_format)
+        if job.page_length is not None:
+            draw_document(job.bot, job.top, job.page_length, section,
+                          ms_values, job.scale, job.formations,
+                          legend=job.legend, filename=job.filename,
+                          current_data=job.current_data,
+                          annotation=job.annotation, target=buffer)
+        else:
+            if callable(section):
+                section = section(job.bot, job.top)
+                ms_values = ms_values(job.bot, job.top)
+            if output_format == 'png':
+                draw_png(job.bot, job.top, section, ms_values, job.scale,
+                         job.formations, buffer, ppi, legend=job.legend,
+                         current_data=job.current_data,
+                         annotation=job.annotation)
+            else:
+                draw_page(job.bot, job.top, section, ms_values, job.scale,
+                          job.formations, legend=job.legend,
+                          filename=job.filename,
+                          current_data=job.current_data,
+                          annotation=job.annotation, target=buffer)
+    if stream is None:
+        return buffer.getvalue()
+
+
+def render_job(job):
+    section, ms_values = start_job(job)
+    if job.page_length is not None:
+        # pass stream factories through, as each page needs its own stream
+        draw_document(job.bot, job.top, job.page_length,
+                      worker_data['section'], worker_data['ms_values'],
+                      job.scale, job.formations, legend=job.legend,
+                      filename=job.filename, current_data=job.current_data,
+                      annotation=job.annotation)
+        return job.filename
+    draw_page(job.bot, job.top, section, ms_values, job.scale,
+              job.formations, legend=job.legend, filename=job.filename,
+              current_data=job.current_data, annotation=job.annotation)
+    return job.filename
+
+
+def render_jobs(jobs, section, ms_values, processes=None):
+    # Start the most expensive pages first so that the total run time is
+    # close to that of the slowest page.
+    jobs = sorted(jobs, key=PageJob.cost, reverse=True)
+    if not jobs:
+        return []
+    if processes == 1:
+        init_worker(section, ms_values)
+        return [render_job(job) for job in jobs]
+    with Pool(processes, initializer=init_worker,
+              initargs=(section, ms_values)) as pool:
+        return list(pool.imap_unordered(render_job, jobs))
+
+
+# Set to a directory to also render every page as a pyramid of PNG tiles
+# for web viewing, in <tile_dir>/<page>/<zoom>/<column>/<row>.png.
+tile_dir = None
+tile_size = 256  # width and height of a tile in pixels
+tile_zooms = (0, 1, 2, 3)  # at zoom z, the page is 2**z tiles wide
+
+
+def tile_grid(job, zoom):
+    """Return the tile size in points and the numbers of tile columns and
+    rows for a page at a zoom level."""
+    tile_pt = page_width / 2 ** zoom
+    rows = int(ceil(page_height(job.bot, job.top, job.scale) / tile_pt))
+    return tile_pt, 2 ** zoom, rows
+
+
+def tile_row_depths(job, zoom, row):
+    """Return the range of depths covered by a row of tiles."""
+    tile_pt = tile_grid(job, zoom)[0]
+    page = Page.for_log(job.bot, job.top, job.scale)
+    return page.height((row + 1) * tile_pt), page.height(row * tile_pt)
+
+
+def render_tile_row(task):
+    """Render one row of tiles for a page.
+
+    The row is drawn once onto a strip as wide as the page and then cut
+    into tiles.
+    """
+    job, zoom, row, out_dir = task
+    section, ms_values = start_job(job)
+    tile_pt, columns, rows = tile_grid(job, zoom)
+    strip = cairo.ImageSurface(cairo.FORMAT_ARGB32, columns * tile_size,
+                               tile_size)
+    ctx = cairo.Context(strip)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    ctx.scale(tile_size / tile_pt, tile_size / tile_pt)
+    ctx.translate(0, -row * tile_pt)
+    ctx.set_source_rgb(0, 0, 0)
+    # Only draw beds near this row; symbols and labels can reach a little
+    # beyond their beds, so allow a margin.
+    bot, top = tile_row_depths(job, zoom, row)
+    margin = 40 / job.scale
+    draw_page_content(ctx, job.bot, job.top, section, ms_values, job.scale,
+                      job.formations, job.legend, job.current_data,
+                      job.annotation, (bot - margin, top + margin))
+    strip.flush()
+    for column in range(columns):
+        tile = cairo.ImageSurface(cairo.FORMAT_ARGB32, tile_size, tile_size)
+        tile_ctx = cairo.Context(tile)
+        tile_ctx.set_source_surface(strip, -column * tile_size, 0)
+        tile_ctx.paint()
+        tile_path = os.path.join(out_dir, str(zoom), str(column))
+        os.makedirs(tile_path, exist_ok=True)
+        tile.write_to_png(os.path.join(tile_path, '%d.png' % row))
+    return zoom, row
+
+
+def render_tiles(job, section, ms_values, out_dir, zooms=tile_zooms,
+                 processes=None, force=False):
+    """Render a page as a pyramid of PNG tiles, in parallel.
+
+    The page's fingerprint is kept in a manifest in out_dir, written once
+    all the tiles have been rendered. Unless force is set, only rows of
+    tiles that overlap the depths changed since then (or have not been
+    rendered yet) are drawn.
+    """
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            old = json.load(f)
+    except (OSError, ValueError):
+        old = None
+    if not isinstance(old, dict) or \
+            not isinstance(old.get('fingerprint'), dict):
+        old = {}
+    new = {'tile_size': tile_size,
+           'fingerprint': job_fingerprint(job, section, ms_values,
+                                          code_version())}
+    if force or old.get('tile_size') != tile_size:
+        changed = None
+    elif old['fingerprint'].get('fingerprint') == \
+            new['fingerprint']['fingerprint']:
+        changed = []  # only render tiles missing from out_dir
+    else:
+        changed = changed_range(job, old['fingerprint'], new['fingerprint'])
+        changed = None if changed is None else [changed]
+    tasks = []
+    for zoom in zooms:
+        columns, rows = tile_grid(job, zoom)[1:]
+        for row in range(rows):
+            bot, top = tile_row_depths(job, zoom, row)
+            rendered = os.path.exists(os.path.join(
+                out_dir, str(zoom), str(columns - 1), '%d.png' % row))
+            if changed is None or not rendered or \
+                    any(bot <= c_top and top >= c_bot
+                        for (c_bot, c_top) in changed):
+                tasks.append((job, zoom, row, out_dir))
+    if not tasks:
+        rendered = []
+    elif processes == 1:
+        init_worker(section, ms_values)
+        rendered = [render_tile_row(task) for task in tasks]
+    else:
+        with Pool(processes, initializer=init_worker,
+                  initargs=(section, ms_values)) as pool:
+            rendered = list(pool.imap_unordered(render_tile_row, tasks))
+    if old != new:
+        os.makedirs(out_dir, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump(new, f, indent=1, sort_keys=True)
+    return rendered
+
+
+manifest_filename = 'output/manifest.json'
+# The files, besides the inputs, that determine the rendered pages
+code_files = ('make-log.py', 'symb.py', 'fonts.py',
+              'NimbusSanL-ReguCond.ttf')
+
+
+def code_version():
+    digest = hashlib.sha1(str(symb.pattern_version).encode())
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in code_files:
+        with open(os.path.join(base, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Depth bands (in cm) in which changes to a page's input data are traced,
+# so that only the tiles covering changed bands need to be rendered again
+fingerprint_band = 50
+
+
+def job_fingerprint(job, section, ms_values, version):
+    """Return a hash of everything that determines the content of a page.
+
+    Returns a dict of the hash as 'fingerprint', along with its parts:
+    'layout', which covers the job's settings and column positions and
+    the code and pattern version, and 'bands', a hash for each band of
+    fingerprint_band cm from the bottom of the page. A band's hash covers
+    the input rows of the beds whose bottoms lie in it (and the bed above
+    each of them), and the magnetic susceptibility points drawn in it.
+    """
+    n_bands = max(1, int(ceil((job.top - job.bot) / fingerprint_band)))
+    bands = [hashlib.sha1() for i in range(n_bands)]
+
+    def band_of(heights):
+        band = np.floor((heights - job.bot) / fingerprint_band).astype(int)
+        return np.clip(band, 0, n_bands - 1)
+
+    if callable(section):
+        section = section(job.bot, job.top)
+        ms_values = ms_values(job.bot, job.top)
+    for chunk in chunks(section):
+        beds = chunk.window(job.bot, job.top)
+        bed_bands = band_of(chunk.bot[beds])
+        for band in np.unique(bed_bands):
+            rows = beds[bed_bands == band]
+            rows = np.union1d(rows, rows - 1)
+            rows = rows[rows >= 0]
+            digest = bands[band]
+            for name in list(float_columns) + list(code_columns):
+                digest.update(getattr(chunk, name)[rows].tobytes())
+            for name in text_columns:
+                digest.update(
+                    '\x1f'.join(getattr(chunk, name)[rows]).encode())
+    # The decimation level, and which points are kept at it, depend on the
+    # whole series, so hash the points that are actually drawn.
+    resolution = job.settings.get('magsus_resolution',
+                                  LogSettings().magsus_resolution)
+    for chunk in chunks(ms_values):
+        level = chunk.for_scale(job.scale, resolution)
+        heights, values = level.window(job.bot, job.top)
+        point_bands = band_of(heights)
+        for band in np.unique(point_bands):
+            in_band = point_bands == band
+            bands[band].update(heights[in_band].tobytes())
+            bands[band].update(values[in_band].tobytes())
+    settings = {}
+    for name, value in job.settings.items():
+        if isinstance(value, Sites):
+            value = value.window_text(job.bot, job.top)
+        settings[name] = value
+    spec = [job.bot, job.top, job.scale, job.formations, job.filename,
+            settings, make_hz_pos(job.hz_pos), job.legend, job.current_data,
+            job.annotation, job.page_length]
+    layout = hashlib.sha1(version.encode())
+    layout.update(json.dumps(spec, sort_keys=True, default=vars).encode())
+    result = {'layout': layout.hexdigest(),
+              'bands': [band.hexdigest() for band in bands]}
+    result['fingerprint'] = hashlib.sha1(
+        (result['layout'] + ''.join(result['bands'])).encode()).hexdigest()
+    return result
+
+
+def changed_range(job, old, new):
+    """Return the depth range of a page affected by a change of its
+    fingerprint from old to new, or None if the whole page may be.
+
+    Symbols are spaced from the top of the page down, so a change in one
+    band can move symbols anywhere below it; a band's margin above is
+    allowed for beds merged by generalize().
+    """
+    if not isinstance(old, dict) or old.get('layout') != new['layout'] or \
+            len(old.get('bands', ())) != len(new['bands']):
+        return None
+    changed = [i for i, (a, b) in enumerate(zip(old['bands'], new['bands']))
+               if a != b]
+    if not changed:
+        return None
+    top = job.bot + (max(changed) + 2) * fingerprint_band
+    return job.bot, min(top, job.top)
+
+
+def job_output(job):
+    if job.settings.get('pdf_output', LogSettings().pdf_output):
+        return job.filename + '.pdf'
+    return job.filename + '.svg'
+
+
+def read_manifest():
+    try:
+        with open(manifest_filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def rebuild(jobs, section, ms_values, processes=None, force=False):
+    """Render the jobs whose fingerprints have changed since the last run.
+
+    Fingerprints of rendered pages are kept in the manifest next to the
+    output files. Returns a dict mapping each job rendered to the depth
+    range of its page that changed, or None if the whole page did.
+    """
+    manifest = read_manifest()
+    version = code_version()
+    fingerprints = {}
+    stale = {}
+    for job in jobs:
+        output = job_output(job)
+        new = job_fingerprint(job, section, ms_values, version)
+        fingerprints[output] = new
+        old = manifest.get(output)
+        if force or not os.path.exists(output):
+            stale[job] = None
+        elif not isinstance(old, dict) or \
+                old.get('fingerprint') != new['fingerprint']:
+            stale[job] = changed_range(job, old, new)
+    render_jobs(list(stale), section, ms_values, processes)
+    manifest.update(fingerprints)
+    with open(manifest_filename, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return stale
+
+
+# Set to a (host, port) pair to run as a render daemon instead of writing
+# the output files.
+daemon_address = None
+
+content_types = {'pdf': 'application/pdf', 'svg': 'image/svg+xml',
+                 'png': 'image/png'}
+
+# Columns that a render request may choose to draw. The pmag graph takes
+# the place of the colour and notes columns, so it can't be drawn with them.
+optional_columns = ('colour', 'notes', 'pmag')
+
+
+class WarmInputs:
+    """Parsed input files kept in memory, reloaded when they change."""
+
+    def __init__(self, readers):
+        # readers maps a name to a (filename, reader function) pair
+        self.readers = readers
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        filename, reader = self.readers[name]
+        mtime = os.stat(filename).st_mtime_ns
+        with self.lock:
+            if name not in self.loaded or self.loaded[name][0] != mtime:
+                logger.info('loading %s', filename)
+                self.loaded[name] = (mtime, reader(filename))
+            return self.loaded[name][1]
+
+
+# The largest image, in pixels along either side, that cairo can draw
+max_image_size = 32767
+# Limits on the pages the daemon draws in any format, which keep a single
+# request from holding render_lock for long: the largest PDF page in
+# points, and the longest depth range in cm, which bounds the axis ticks.
+max_page_height = 14400
+max_depth_span = 100000
+
+
+def query_number(query, name, default=None):
+    """Return a finite number from a query parameter, or default."""
+    if name not in query and default is not None:
+        return default
+    value = float(query[name])
+    if not isfinite(value):
+        raise ValueError('%s must be finite' % name)
+    return value
+
+
+def request_job(query, inputs):
+    """Make a PageJob and resolution from the query parameters of a
+    render request.
+
+    bot and top give the depth range in cm; scale, format and ppi are
+    optional, as is columns, a comma-separated subset of
+    optional_columns to draw. By default, columns follows the pages of
+    page_jobs(): colour and notes at scales of 0.5 and above, and neither
+    on the smaller-scale summary pages.
+    """
+    bot = query_number(query, 'bot')
+    top = query_number(query, 'top')
+    scale = query_number(query, 'scale', 0.24)
+    ppi = query_number(query, 'ppi', 72)
+    if not (bot < top and scale > 0 and ppi > 0):
+        raise ValueError('need bot < top, scale > 0 and ppi > 0')
+    if top - bot > max_depth_span or \
+            page_height(bot, top, scale) > max_page_height:
+        raise ValueError('page would be too large')
+    if query.get('format') == 'png' and ppi / 72 * max(
+            page_width, page_height(bot, top, scale)) > max_image_size:
+        raise ValueError('image would be too large')
+    if 'columns' in query:
+        columns = set(query['columns'].split(',')) - {''}
+    elif scale < 0.5:
+        columns = set()
+    else:
+        columns = {'colour', 'notes'}
+    unknown = columns - set(optional_columns)
+    if unknown:
+        raise ValueError('unknown columns: ' + ', '.join(sorted(unknown)))
+    if 'pmag' in columns and columns & {'colour', 'notes'}:
+        raise ValueError('pmag cannot be drawn with colour or notes')
+    settings = dict(summary_settings) if scale < 0.5 else {}
+    if 'pmag' in columns:
+        settings['decs_incs_list'] = inputs.get('sites')
+    hz_pos = dict((name, None) for name in ('colour', 'notes')
+                  if name not in columns)
+    formations = fmns_summary if scale < 0.5 else fmns_paged
+    job = PageJob(bot, top, scale, clip_formations(formations, bot, top),
+                  settings=settings, hz_pos=hz_pos)
+    return job, ppi
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """Serves GET /render?bot=...&top=...[&scale=...][&format=...]
+    [&ppi=...][&columns=...] from the inputs held by the server."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self.send_error(404)
+            return
+        query = dict(parse_qsl(url.query))
+        output_format = query.get('format', 'pdf')
+        try:
+            if output_format not in content_types:
+                raise ValueError('unknown format %r' % output_format)
+            inputs = self.server.inputs
+            job, ppi = request_job(query, inputs)
+            data = render_page(job, inputs.get('section'),
+                               inputs.get('ms_values'),
+                               output_format=output_format, ppi=ppi)
+        except KeyError as e:
+            self.send_error(400, 'missing parameter %s' % e)
+            return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except Exception:
+            logger.exception('Failed to render %s', self.path)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_types[output_format])
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(address):
+    """Render pages on request over HTTP, keeping the inputs loaded."""
+    inputs = WarmInputs({
+        'section': ('input-data/sed-data.csv', read_csv),
+        'ms_values': ('input-data/ms.txt', read_magsus),
+        'sites': ('input-data/site-incdec.csv', read_sites)})
+    for name in inputs.readers:
+        inputs.get(name)
+    server = ThreadingHTTPServer(address, RenderHandler)
+    server.inputs = inputs
+    logger.info('Serving on http://%s:%d/render', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def job_name(job):
+    return os.path.basename(job.filename)
+
+
+def select_jobs(jobs, names=None, depth_range=None, scale=None):
+    """Pick out the jobs matching all the given criteria.
+
+    names is a list of shell-style patterns matched against the output
+    filenames without their directory, depth_range a (bot, top) pair
+    which a job's range must overlap, and scale a page scale.
+    """
+    selected = []
+    for job in jobs:
+        if names and not any(fnmatch(job_name(job), name)
+                             for name in names):
+            continue
+        if depth_range is not None and \
+                not (job.bot < depth_range[1] and job.top > depth_range[0]):
+            continue
+        if scale is not None and job.scale != scale:
+            continue
+        selected.append(job)
+    return selected
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Draw sediment logs of the Fairfield Quarry section.')
+    parser.add_argument('pages', metavar='PAGE', nargs='*',
+                        help='names of pages to render, such as ffq2100 '
+                        'or ffq-log-entire*; by default all pages')
+    parser.add_argument('--range', metavar=('BOT', 'TOP'), nargs=2,
+                        type=float, dest='depth_range',
+                        help='only render pages overlapping this range '
+                        '(in cm)')
+    parser.add_argument('--scale', type=float,
+                        help='only render pages at this scale')
+    parser.add_argument('--page-length', metavar='CM', type=float,
+                        help='split each selected page into a multi-page '
+                        'PDF of pages this many cm high')
+    parser.add_argument('--list', action='store_true',
+                        help='list the selected pages without rendering')
+    parser.add_argument('--force', action='store_true',
+                        help='render pages even if they are up to date')
+    parser.add_argument('--processes', type=int,
+                        help='number of rendering processes')
+    parser.add_argument('--chunk-size', type=int, default=stream_chunk_size,
+                        help='stream the inputs in chunks of this many rows')
+    parser.add_argument('--tiles', metavar='DIR', default=tile_dir,
+                        help='also render PNG tiles into this directory')
+    parser.add_argument('--trace', action='store_true',
+                        help='log the time and operations of each column')
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        type=parse_address, default=daemon_address,
+                        help='run as a render daemon on this address')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format='%(message)s')
+    if args.trace:
+        logger.setLevel(TRACE)
+    if args.serve is not None:
+        if not args.trace:
+            logger.setLevel(logging.INFO)
+        serve(args.serve)
+        return
+    jobs = select_jobs(page_jobs(), args.pages, args.depth_range, args.scale)
+    if args.page_length is not None:
+        if not args.page_length > 0:
+            exit('The page length must be positive.')
+        for job in jobs:
+            if job.current_data is not None or job.annotation is not None:
+                exit('%s has currents or annotations, so it can\'t be split '
+                     'into pages.' % job_name(job))
+            job.page_length = args.page_length
+    if args.list:
+        for job in jobs:
+            print('%-20s %6g %6g %6g' % (job_name(job), job.bot, job.top,
+                                         job.scale))
+        return
+    if not jobs:
+        exit('No pages match the selection.')
+    # load the fonts before any worker processes are started
+    fonts.face(LogSettings().font_name)
+    symb.glc_face()
+    if args.chunk_size is None:
+        section = read_csv('input-data/sed-data.csv')
+        ms_values = read_magsus('input-data/ms.txt')
+    else:
+        section = partial(iter_csv, 'input-data/sed-data.csv',
+                          args.chunk_size)
+        ms_values = partial(iter_magsus, 'input-data/ms.txt',
+                            args.chunk_size)
+    rebuild(jobs, section, ms_values, args.processes, args.force)
+    if args.tiles is not None:
+        for job in jobs:
+            render_tiles(job, section, ms_values,
+                         os.path.join(args.tiles, job_name(job)),
+                         processes=args.processes, force=args.force)
 
 
 if __name__ == "__main__":
@@ -22,11 +22,16 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import hashlib
+import json
+import os
 import random
 from math import pi
 
 import cairocffi as cairo
 
+import fonts
+
 
 def calc(c, x, y, s):
     c.move_to(x - s, y - s / 2)
@@ -40,18 +45,26 @@ def calc(c, x, y, s):
     c.stroke()
 
 
+font_name = 'NimbusSanLCon'
+
+
+def glc_face():
+    """Return the font face of the g symbols."""
+    return fonts.face(font_name, bold=True)
+
+
+def glc_positions(x, y, width, pc):
+    """Return the positions of the g symbols drawn by glc."""
+    gs = glc_count(pc)
+    return [(x + i * (width / (gs + 1)) - 3, y) for i in range(1, gs + 1)]
+
+
 def glc(c, x, y, width, pc):
     c.save()
-    c.select_font_face('NimbusSanLCon', cairo.FONT_SLANT_NORMAL,
-                       cairo.FONT_WEIGHT_BOLD)
+    c.set_font_face(glc_face())
     c.set_source_rgb(0, 0, 0)
-    gs = 0
-    limits = (0, 5, 20, 50, 80)
-    for limit in limits:
-        if pc > limit:
-            gs += 1
-    for i in range(1, gs + 1):
-        c.move_to(x + i * (width / (gs + 1)) - 3, y)
+    for (g_x, g_y) in glc_positions(x, y, width, pc):
+        c.move_to(g_x, g_y)
         c.show_text('g')
     c.restore()
 
@@ -89,12 +102,53 @@ def burrow(c, x, y, s, pyt=False):
     c.stroke()
     if pyt:
         c.move_to(x + s * 0.8, y + s * 0.7)
-        c.select_font_face('NimbusSanLCon', cairo.FONT_SLANT_NORMAL,
-                           cairo.FONT_WEIGHT_NORMAL)
+        c.set_font_face(fonts.face(font_name))
         c.show_text('P')
     c.restore()
 
 
+symbol_functions = {'calc': calc, 'wood': wood, 'burrow': burrow}
+
+stamps = {}
+
+
+def record_symbol(name, size, *variant):
+    """Record a symbol drawn at the origin onto a recording surface."""
+    margin = 4 * size + 8
+    surface = cairo.RecordingSurface(
+        cairo.CONTENT_COLOR_ALPHA,
+        (-margin, -margin, 2 * margin + size * 4, 2 * margin))
+    symbol_functions[name](cairo.Context(surface), 0, 0, size, *variant)
+    return surface
+
+
+def stamp(c, name, x, y, size, *variant):
+    """Draw a symbol at (x, y) by replaying a recording of it.
+
+    Each variant of a symbol (name, size and any further arguments of the
+    symbol function) is recorded once per process, so that it is emitted
+    as a single shared form object in PDF output. Unlike the symbol
+    functions, stamp leaves the state of the context unchanged.
+    """
+    key = (name, size) + variant
+    if key not in stamps:
+        stamps[key] = record_symbol(name, size, *variant)
+    c.save()
+    c.set_source_surface(stamps[key], x, y)
+    c.paint()
+    c.restore()
+
+
+def glc_count(pc):
+    """Return the number of g symbols drawn for a glauconite percentage."""
+    gs = 0
+    limits = (0, 5, 20, 50, 80)
+    for limit in limits:
+        if pc > limit:
+            gs += 1
+    return gs
+
+
 def silt_pattern():
     p_surface = \
         cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, (0, 0, 32, 8))
@@ -126,22 +180,32 @@ def silt_pattern():
     return pattern
 
 
-def sand_pattern():
+def sand_geometry(seed=11, wiggle=3):
+    """Return the centres of the randomly jittered grains of the sand
+    pattern."""
+    rng = random.Random(seed)
+    sc = 3.6
+    offs = 1.8
+    centres = []
+    for x in range(0, 10):
+        for y in range(0, 10):
+            dx = rng.random() * wiggle - wiggle / 2
+            dy = rng.random() * wiggle - wiggle / 2
+            centres.append((offs + x * sc + dx, offs + y * sc + dy))
+    return centres
+
+
+def sand_pattern(centres=None):
+    if centres is None:
+        centres = sand_geometry()
     p_surface = \
         cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, (0, 0, 36, 36))
     p_ctx = cairo.Context(p_surface)
     r = 0.5
-    wiggle = 3
-    sc = 3.6
-    offs = 1.8
-    random.seed(11)
     p_ctx.set_source_rgb(0, 0, 0)
-    for x in range(0, 10):
-        for y in range(0, 10):
-            p_ctx.arc(offs + x * sc + random.random() * wiggle - wiggle / 2,
-                      offs + y * sc + random.random() * wiggle - wiggle / 2,
-                      r, 0, 2 * pi)
-            p_ctx.fill()
+    for (x, y) in centres:
+        p_ctx.arc(x, y, r, 0, 2 * pi)
+        p_ctx.fill()
     # for x in range(0,2):
     #     for y in range(0,2):
     #         burrow(p_ctx, 4.5+x*18+random.random()*8.-8./2.,
@@ -151,21 +215,90 @@ def sand_pattern():
     return pattern
 
 
-def burrow_pattern():
+def burrow_geometry(seed=17):
+    """Return the positions of the burrows in the burrow pattern."""
+    rng = random.Random(seed)
+    positions = []
+    for x in range(0, 4):
+        for y in range(0, 2):
+            positions.append((4.5 + x * 24 + rng.random() * 8,
+                              9 + y * 36 + rng.random() * 8 + x * 8))
+    return positions
+
+
+def burrow_pattern(positions=None):
+    if positions is None:
+        positions = burrow_geometry()
     p_surface = \
         cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, (0, 0, 36, 36))
     ctx = cairo.Context(p_surface)
-    random.seed(17)
     ctx.set_source_rgb(0, 0, 0)
-    for x in range(0, 4):
-        for y in range(0, 2):
-            burrow(ctx, 4.5 + x * 24 + random.random() * 8,
-                   9 + y * 36 + random.random() * 8 + x * 8, 2)
+    for (x, y) in positions:
+        burrow(ctx, x, y, 2)
     pattern = cairo.SurfacePattern(p_surface)
     pattern.set_extend(cairo.EXTEND_REPEAT)
     return pattern
 
 
+# Increase this whenever the geometry of a pattern changes, to invalidate
+# the geometry cached on disk.
+pattern_version = 1
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# pattern name -> (geometry function, pattern function); patterns without
+# random geometry have no geometry function.
+pattern_types = {
+    'sand': (sand_geometry, sand_pattern),
+    'silt': (None, silt_pattern),
+    'burrow': (burrow_geometry, burrow_pattern)
+}
+
+patterns = {}
+
+
+def cached_geometry(name, params):
+    """Return the geometry of a pattern, reading it from the disk cache if
+    it has been generated before and writing it there if not."""
+    geometry_function = pattern_types[name][0]
+    key = json.dumps([name, pattern_version, sorted(params.items())])
+    path = os.path.join(cache_dir, 'pattern-%s-%s.json' %
+                        (name, hashlib.sha1(key.encode()).hexdigest()[:16]))
+    try:
+        with open(path) as f:
+            return [tuple(point) for point in json.load(f)]
+    except (OSError, ValueError):
+        pass
+    geometry = geometry_function(**params)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename, so concurrent processes never see a partial file
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(geometry, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return geometry
+
+
+def get_pattern(name, **params):
+    """Return the named pattern fill, building it on first use.
+
+    Patterns are kept for the life of the process, keyed by name and
+    parameters; the parameters are passed to the pattern's geometry
+    function.
+    """
+    key = (name, tuple(sorted(params.items())))
+    if key not in patterns:
+        geometry_function, pattern_function = pattern_types[name]
+        if geometry_function is None:
+            patterns[key] = pattern_function(**params)
+        else:
+            patterns[key] = pattern_function(cached_geometry(name, params))
+    return patterns[key]
+
+
 def irregular_contact(ctx, x, y, width):
     wave_w = 12
     wave_h = 3